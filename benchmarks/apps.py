@@ -0,0 +1,33 @@
+'''Stand-in WSGI apps for the benchmarks, so they can run without any network access.'''
+import json
+
+
+def hello_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '5')])
+    return [b'hello']
+
+
+def json_app(environ, start_response):
+    # Reads the request body, and echoes it back inside a JSON document.
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    data = environ['wsgi.input'].read(length) if length else environ['wsgi.input'].read()
+    body = json.dumps({'ok': True, 'received': len(data),
+                       'type': environ.get('CONTENT_TYPE')}).encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def make_stream_app(size, chunk_size=64 * 1024):
+    # Streams a body of the given size, in chunks.
+    chunk = b'x' * chunk_size
+    count, remainder = divmod(size, chunk_size)
+
+    def stream_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/octet-stream'),
+                                  ('Content-Length', str(size))])
+        for _ in range(count):
+            yield chunk
+        if remainder:
+            yield chunk[:remainder]
+    return stream_app
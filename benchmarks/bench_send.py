@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''Microbenchmark for the per-request overhead of WSGIAdapter.send.
+
+Sends requests straight through the adapter (without a session) to a trivial
+app, and reports the number of requests handled per second for each mode::
+
+    python benchmarks/bench_send.py [--requests N] [--repeat N]
+'''
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from apps import hello_app  # noqa: E402
+from pyriform import WSGIAdapter  # noqa: E402
+from requests import Request  # noqa: E402
+
+
+def make_sender(adapter, method='GET', url='http://bench.local/some/path?a=1', **kwargs):
+    request = Request(method, url, headers={'X-Bench': 'yes'}, **kwargs).prepare()
+
+    def send():
+        resp = adapter.send(request)
+        resp.raw.read()
+        resp.close()
+    return send
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    modes = [('webtest', {})]
+    try:
+        WSGIAdapter(hello_app, raw=True)
+    except TypeError:  # Older versions without raw mode.
+        pass
+    else:
+        modes.append(('raw', {'raw': True}))
+
+    def report(name, method, func):
+        best = min(timeit.repeat(func, number=args.requests, repeat=args.repeat))
+        print('%-8s %-5s %10.0f req/s' % (name, method, args.requests / best))
+
+    for mode, kwargs in modes:
+        for method, extra in [('GET', {}), ('POST', {'data': b'x' * 64})]:
+            report(mode, method, make_sender(WSGIAdapter(hello_app, **kwargs), method, **extra))
+
+    # Just the cost of building the environ for the raw mode.
+    if len(modes) > 1:
+        adapter = WSGIAdapter(hello_app, raw=True)
+        request = Request('GET', 'http://bench.local/some/path?a=1').prepare()
+        report('environ', 'GET', lambda: adapter._make_environ(request))
+
+
+if __name__ == '__main__':
+    main()
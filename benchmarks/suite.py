@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+'''Benchmark suite for the WSGIAdapter hot path.
+
+Runs a set of scenarios against local stand-in apps (see apps.py), for each
+adapter mode, and reports throughput and latency percentiles. Results can be
+saved as JSON and compared against an earlier run to spot regressions::
+
+    python benchmarks/suite.py --output after.json --compare before.json
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from apps import hello_app, json_app, make_stream_app  # noqa: E402
+from pyriform import WSGIAdapter  # noqa: E402
+from requests import Request  # noqa: E402
+
+LARGE_BODY = 8 * 1024 * 1024
+
+
+def scenario_get(adapter_kwargs):
+    adapter = WSGIAdapter(hello_app, **adapter_kwargs)
+    request = Request('GET', 'http://bench.local/hello?a=1').prepare()
+
+    def run():
+        adapter.send(request).raw.read()
+    return run, 1
+
+
+def scenario_post_json(adapter_kwargs):
+    adapter = WSGIAdapter(json_app, **adapter_kwargs)
+    payload = {'name': 'pyriform', 'tags': ['a', 'b', 'c'], 'count': 3}
+    request = Request('POST', 'http://bench.local/items', json=payload).prepare()
+
+    def run():
+        adapter.send(request).raw.read()
+    return run, 1
+
+
+def scenario_multipart(adapter_kwargs):
+    adapter = WSGIAdapter(json_app, **adapter_kwargs)
+    files = {'upload': ('data.bin', b'\x00\x01' * 32 * 1024)}
+    request = Request('POST', 'http://bench.local/upload', files=files,
+                      data={'field': 'value'}).prepare()
+
+    def run():
+        adapter.send(request).raw.read()
+    return run, 1
+
+
+def scenario_large_stream(adapter_kwargs):
+    adapter = WSGIAdapter(make_stream_app(LARGE_BODY), **adapter_kwargs)
+    request = Request('GET', 'http://bench.local/large').prepare()
+
+    def run():
+        resp = adapter.send(request, stream=True)
+        for _ in resp.iter_content(64 * 1024):
+            pass
+    return run, LARGE_BODY
+
+
+def scenario_timeout(adapter_kwargs):
+    adapter = WSGIAdapter(hello_app, **adapter_kwargs)
+    request = Request('GET', 'http://bench.local/hello').prepare()
+
+    def run():
+        adapter.send(request, timeout=5).raw.read()
+    return run, 1
+
+
+def scenario_timeout_pool(adapter_kwargs):
+    return scenario_timeout(dict(adapter_kwargs, max_workers=4))
+
+
+SCENARIOS = [
+    ('get', scenario_get, 2000),
+    ('post_json', scenario_post_json, 2000),
+    ('multipart', scenario_multipart, 500),
+    ('large_stream', scenario_large_stream, 20),
+    ('timeout', scenario_timeout, 1000),
+    ('timeout_pool', scenario_timeout_pool, 1000),
+]
+
+MODES = [
+    ('webtest', {}),
+    ('raw', {'raw': True}),
+]
+
+
+def measure(run, iterations):
+    # Warm up first, so that caches and lazy imports don't count against us.
+    for _ in range(min(iterations // 10, 50) + 1):
+        run()
+
+    timings = []
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(iterations):
+        then = clock()
+        run()
+        timings.append(clock() - then)
+    total = clock() - start
+    timings.sort()
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))] * 1e6
+
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / total,
+        'mean_us': total / iterations * 1e6,
+        'p50_us': percentile(0.5),
+        'p90_us': percentile(0.9),
+        'p99_us': percentile(0.99),
+    }
+
+
+def pyriform_version():
+    try:
+        from importlib.metadata import version
+        return version('pyriform')
+    except Exception:  # pylint: disable=broad-except
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='file to write the results to as JSON')
+    parser.add_argument('--compare', help='JSON results from an earlier run to compare with')
+    parser.add_argument('--label', help='a label to store with the results (e.g. a version)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier for the number of iterations of each scenario')
+    parser.add_argument('--only', action='append', help='only run scenarios with this name')
+    args = parser.parse_args(argv)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    results = {}
+    for mode, adapter_kwargs in MODES:
+        for name, scenario, iterations in SCENARIOS:
+            if args.only and name not in args.only:
+                continue
+            key = '%s/%s' % (mode, name)
+            run, units = scenario(adapter_kwargs)
+            result = measure(run, max(1, int(iterations * args.scale)))
+            if units > 1:
+                result['mb_per_sec'] = result['ops_per_sec'] * units / (1024 * 1024)
+            results[key] = result
+
+            line = '%-22s %10.0f ops/s  p50 %8.1fus  p99 %8.1fus' % (
+                key, result['ops_per_sec'], result['p50_us'], result['p99_us'])
+            if previous and key in previous:
+                change = result['ops_per_sec'] / previous[key]['ops_per_sec'] - 1
+                line += '  %+6.1f%%' % (change * 100)
+            print(line)
+
+    if args.output:
+        document = {
+            'label': args.label,
+            'pyriform_version': pyriform_version(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1077 @@
+from collections import deque
+from concurrent import futures
+import io
+import mmap
+import os
+import re
+from requests.adapters import BaseAdapter, Response
+from requests import ConnectionError, Request, Session, Timeout  # pylint: disable=redefined-builtin
+from requests.exceptions import ReadTimeout
+import six
+from six.moves.urllib.parse import unquote_to_bytes
+import sys
+import tempfile
+import time
+import warnings
+try:
+    from functools import lru_cache
+except ImportError:  # pragma: no cover
+    from backports.functools_lru_cache import lru_cache
+from webtest.app import TestApp, TestRequest
+from webtest.response import TestResponse
+from webob.response import iter_close
+import threading
+
+from pyriform.instrument import RequestTimings, TimedIterable
+
+__all__ = ['WSGIAdapter', 'batch', 'make_session']
+
+# Methods which have dedicated handlers on TestApp.
+_NON_BODY_METHODS = frozenset('GET HEAD DELETE OPTIONS'.split())
+_WITH_BODY_METHODS = frozenset('POST PUT PATCH'.split())
+
+# Splits a URL into scheme, netloc, path and query (discarding any fragment).
+_URL_PARTS = re.compile(r'([^:/?#]+)://([^/?#]*)([^?#]*)(?:\?([^#]*))?')
+
+
+def make_session(app, prefix='http://', **kwargs):
+    '''Convenience function for creating a session which maps the app to a particular URL.
+
+    If you need to have more control over the :py:class:`WSGIAdapter` instance that's created,
+    or you need to generate a session in a different way, then you can just do it manually.
+
+    Args:
+        app (WSGI application): The app to send requests to - this should be a
+            callable which takes two arguments: *environ* and *start_response*.
+
+            Alternatively, you can pass a :py:class:`~webtest.app.TestApp` object.
+        prefix (string): The URL prefix to mount the app to. Defaults to ``http://`` (e.g. for
+            all HTTP traffic).
+        kwargs: Any other keyword arguments are passed on to :py:class:`WSGIAdapter`.
+
+    Returns:
+        A :py:class:`~requests.Session` object which has the application mounted to the desired
+        URL prefix.
+    '''
+    session = Session()
+    session.mount(prefix, WSGIAdapter(app, **kwargs))
+    return session
+
+
+def batch(app, requests, concurrency=4, ordered=True, session=True, timeout=None, **kwargs):
+    '''Sends many requests to an app concurrently, yielding the responses as they complete.
+
+    The requests are all sent through a single adapter, and are spread across a pool of
+    threads. Only a limited number of requests are taken from *requests* ahead of the
+    responses being consumed, so it can be a very long (or unbounded) iterable.
+
+    Args:
+        app (WSGI application): The app to send requests to. This can also be a
+            ``module:callable`` string, in which case the app is run in a pool of worker
+            processes (see :py:class:`~pyriform.workers.ProcessWSGIAdapter`), or an adapter
+            instance to send the requests through.
+        requests (iterable): :py:class:`~requests.Request` or
+            :py:class:`~requests.PreparedRequest` objects to send.
+        concurrency (int): The number of requests to handle at the same time.
+        ordered (boolean): If true (the default), responses are yielded in the same order as
+            the requests; otherwise they are yielded as soon as each one completes.
+        session (boolean): If true (the default), requests are sent through a
+            :py:class:`~requests.Session`, so redirects and cookies are handled as normal.
+
+            If false, requests are sent straight to the adapter instead, which is quicker if you
+            don't need any of that.
+        timeout (float): The timeout to use for each request.
+        kwargs: Any other keyword arguments are used to create the adapter.
+
+    Returns:
+        A generator of :py:class:`~requests.Response` objects. If sending a request raised an
+        exception, it will be raised when we get to its response.
+    '''
+    if isinstance(app, BaseAdapter):
+        adapter = app
+    elif isinstance(app, six.string_types):
+        from pyriform.workers import ProcessWSGIAdapter
+        adapter = ProcessWSGIAdapter(app, processes=concurrency, **kwargs)
+    else:
+        adapter = WSGIAdapter(app, **kwargs)
+
+    if session:
+        sess = Session()
+        sess.mount('http://', adapter)
+        sess.mount('https://', adapter)
+
+        def send(request):
+            if isinstance(request, Request):
+                request = sess.prepare_request(request)
+            return sess.send(request, timeout=timeout)
+    else:
+        def send(request):
+            if isinstance(request, Request):
+                request = request.prepare()
+            resp = adapter.send(request, timeout=timeout)
+            resp.content  # pylint: disable=pointless-statement
+            return resp
+
+    executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque() if ordered else set()
+    try:
+        for request in requests:
+            if ordered:
+                pending.append(executor.submit(send, request))
+                if len(pending) < concurrency * 2:
+                    continue
+                yield pending.popleft().result()
+            else:
+                pending.add(executor.submit(send, request))
+                if len(pending) < concurrency * 2:
+                    continue
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        if ordered:
+            while pending:
+                yield pending.popleft().result()
+        else:
+            for future in futures.as_completed(pending):
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if adapter is not app:
+            adapter.close()
+
+
+class WSGIAdapter(BaseAdapter):
+
+    '''A Requests adapter that will connect to a WSGI app.
+
+    This object should be mounted as a transport adapter to a
+    :py:class:`~requests.Session` object to have all matching requests sent to
+    it; read more about using transport adapters :ref:`here <transport-adapters>`.
+
+    Args:
+        app (WSGI application): The app to send requests to - this should be a
+            callable which takes two arguments: *environ* and *start_response*.
+
+            Alternatively, you can pass a :py:class:`~webtest.app.TestApp` object.
+        extra_environ (dict of string -> string): Extra environment values that
+            the WSGI app will inherit for every request that it handles.
+        lint (boolean): Enables the :py:mod:`webtest.lint` module for the WSGI application.
+
+            By default, this is disabled - it's useful if you want to test the WSGI app itself,
+            but not if you are testing client-side behaviour.
+        raw (boolean): Call the WSGI application directly, rather than going through WebTest.
+
+            The WSGI environment is built straight from the request, and the response is built
+            straight from what the application returns - this is much faster, but you lose the
+            extra checking that WebTest provides (so it can't be combined with *lint* or a
+            :py:class:`~webtest.app.TestApp` object).
+        max_workers (int): Requests which have a timeout are handled in a background thread;
+            by default, a new thread is started for each of these requests. If this is given,
+            a pool of up to this many threads will be created and reused instead.
+
+            The app is given a :py:class:`threading.Event` as ``pyriform.cancel`` in the
+            environment of these requests, which is set if the request times out, and the
+            time (from :py:func:`time.time`) that the request will time out at as
+            ``pyriform.deadline``. Apps can use these to give up on work that nobody is
+            waiting for. The timeout also applies to producing each chunk of the body.
+        executor (:py:class:`~concurrent.futures.Executor`): An existing executor to handle
+            requests which have a timeout (this can't be combined with *max_workers*).
+        instrument (:py:class:`~pyriform.instrument.Instrument`): An object to notify about
+            how long each part of handling each request takes.
+        cache (:py:class:`~pyriform.cache.ResponseCache`): A cache to store responses from
+            the app in, so that repeated ``GET`` and ``HEAD`` requests can be served from it.
+        max_abandoned (int): The most requests which can have timed out while the app is
+            still handling them. Once there are this many, timed requests fail straight away
+            with a :py:class:`~requests.ConnectionError` until some of them finish.
+        spool_threshold (int): If given, the bodies of streamed responses are read from the
+            app before the response is returned; bodies larger than this many bytes are
+            written to a temporary file, which is exposed through ``resp.raw`` as a seekable,
+            memory-mapped :py:class:`MappedReader`. The file is removed when the response is
+            closed.
+
+            Bodies of responses which aren't streamed are always held in memory by requests,
+            so they aren't spooled.
+    '''
+    def __init__(self, app, extra_environ=None, lint=False, raw=False,
+                 max_workers=None, executor=None, instrument=None, cache=None,
+                 spool_threshold=None, max_abandoned=None):
+        super(WSGIAdapter, self).__init__()
+        self.raw = raw
+        self.instrument = instrument
+        self.cache = cache
+        self.spool_threshold = spool_threshold
+        if executor is not None and max_workers is not None:
+            raise ValueError('cannot pass max_workers and an executor at the same time')
+        self._own_executor = max_workers is not None
+        if self._own_executor:
+            executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.executor = executor
+        self.max_abandoned = max_abandoned
+        self._queued = self._active = self._abandoned = 0
+        self._counter_lock = threading.Lock()
+        if raw:
+            if isinstance(app, TestApp):
+                raise ValueError('cannot use raw mode and pass a TestApp instance'
+                                 ' at the same time')
+            elif lint:
+                raise ValueError('cannot use raw mode and lint at the same time')
+            extra_environ = dict(extra_environ or {})
+        elif not isinstance(app, TestApp):
+            app = TestApp(app, extra_environ=extra_environ, lint=lint)
+            app.RequestClass = PyriformTestRequest
+        elif extra_environ:
+            raise ValueError('cannot pass extra_environ and a TestApp instance'
+                             ' at the same time')
+        elif lint:
+            raise ValueError('cannot use lint and pass a TestApp instance'
+                             ' at the same time')
+        self.app = app
+
+        # Work out everything we can about the environ up front.
+        if raw:
+            self.extra_environ = extra_environ
+            self._environ_template = {
+                'SCRIPT_NAME': '',
+                'SERVER_PROTOCOL': 'HTTP/1.0',
+                'wsgi.version': (1, 0),
+                'wsgi.errors': sys.stderr,
+                'wsgi.multithread': False,
+                'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+                'wsgi.file_wrapper': FileWrapper,
+            }
+            self._environ_template.update(extra_environ)
+        else:
+            self.extra_environ = app.extra_environ
+            self._handlers = dict(
+                (method, getattr(app, method.lower()))
+                for method in _NON_BODY_METHODS | _WITH_BODY_METHODS
+            )
+        self._host_environ = lru_cache(maxsize=256)(self._make_host_environ)
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+
+        if self.instrument is not None:
+            return self._send_instrumented(request, stream, timeout)
+
+        status_code, reason, headerlist, body = self._handle(request, stream, timeout)
+        return _make_response(request, status_code, reason, headerlist, body, stream,
+                              self.spool_threshold)
+
+    def _send_instrumented(self, request, stream, timeout):
+        # This is the same as send, but records how long each step takes.
+        instrument = self.instrument
+        timings = RequestTimings(request.method, request.url)
+        instrument.started(timings)
+        try:
+            status_code, reason, headerlist, body = self._handle(request, stream, timeout,
+                                                                 timings)
+            timings.status_code = status_code
+            body = TimedIterable(body, timings, instrument)
+            if stream and self.spool_threshold is None:
+                resp = _make_response(request, status_code, reason, headerlist, body)
+                timings.mark('converted')
+            else:
+                # Mark the conversion before reading the body, so the phases stay in order.
+                resp = _make_response(request, status_code, reason, headerlist, ())
+                timings.mark('converted')
+                if stream:
+                    _spool_content(resp, body, self.spool_threshold)
+                else:
+                    _load_content(resp, body)
+        except Exception as e:
+            timings.error = e
+            instrument.sent(timings)
+            instrument.finished(timings)
+            raise
+        instrument.sent(timings)
+        return resp
+
+    def _handle(self, request, stream, timeout, timings=None):
+        if self.cache is not None:
+            return self.cache.handle(self._call, request, stream, timeout, timings)
+        return self._call(request, stream, timeout, timings)
+
+    def _call(self, request, stream, timeout, timings=None):
+        # Sends the request to the app, returning the status code, reason, header list
+        # and body iterable of the response.
+
+        # Prepare the request to send to the app.
+        if self.raw:
+            handler = self._call_app
+            params = dict(environ=self._make_environ(request))
+        else:
+            handler, params = self._prepare_testapp_request(request, stream)
+
+        # We only care about the read timeout.
+        if isinstance(timeout, tuple):
+            _, timeout = timeout
+
+        # Let the app know when we'll stop waiting for it.
+        cancel = None
+        if timeout:
+            cancel = threading.Event()
+            environ = params['environ'] if self.raw else params['extra_environ']
+            environ['pyriform.cancel'] = cancel
+            environ['pyriform.deadline'] = time.time() + timeout
+
+        if timings is not None:
+            timings.mark('prepared')
+            if timeout:
+                def handler(_handler=handler, **params):
+                    timings.mark('dispatched')
+                    return _handler(**params)
+
+        appresp = self._invoke_handler(handler, params, timeout, cancel)
+        if timings is not None:
+            timings.mark('handled')
+
+        status_code, _, reason = appresp.status.partition(' ')
+        body = appresp._app_iter
+        if timeout:
+            body = _TimedBody(self, body, timeout, cancel)
+        return int(status_code), reason, appresp.headerlist, body
+
+    def _prepare_testapp_request(self, request, stream):
+        # webob will include the port into the HTTP_HOST header by default.
+        #
+        # It's not desirable, so let's insert it into the environment
+        # manually. But only do this if the user hasn't set an explicit host
+        # name.
+        environ = {}
+        scheme, netloc, _, _ = _URL_PARTS.match(request.url).groups()
+        host = self._host_environ(scheme, netloc).get('HTTP_HOST')
+        if host is not None:
+            environ['HTTP_HOST'] = host
+        if 'wsgi.file_wrapper' not in self.extra_environ:
+            environ['wsgi.file_wrapper'] = FileWrapper
+
+        # We convert the headers ourselves, rather than having webob do it one at a time
+        # after the request has been built.
+        _headers_to_environ(request.headers, environ)
+
+        wtparams = dict(extra_environ=environ, url=request.url, expect_errors=True)
+        if request.method in _WITH_BODY_METHODS:
+            # WebTest can only deal with bodies which are already in memory.
+            body = request.body
+            if hasattr(body, 'read'):
+                body = body.read()
+            elif body is not None and not isinstance(body, (bytes, six.text_type)):
+                body = b''.join(_encode_chunks(body))
+                environ.pop('HTTP_TRANSFER_ENCODING', None)
+            wtparams['params'] = body
+
+        if stream and not issubclass(self.app.RequestClass, PyriformTestRequest):
+            warnings.warn('Passing a TestApp instance to WSGIAdapter prevents '
+                          'streamed requests from streaming content in real time.',
+                          RuntimeWarning)
+
+        # Delegate to the appropriate handler if we have one.
+        handler = self._handlers.get(request.method)
+        if handler is None:
+            # This is an internal method, but most handlers delegate to it, so
+            # we'll just make use of it for unknown methods.
+            wtparams['method'] = request.method
+            handler = self.app._gen_request
+
+        return handler, wtparams
+
+    @property
+    def queue_depth(self):
+        '''The number of timed requests waiting for a worker in the executor.'''
+        return self._queued
+
+    @property
+    def active_workers(self):
+        '''The number of workers in the executor currently handling a timed request.'''
+        return self._active
+
+    @property
+    def abandoned_requests(self):
+        '''The number of requests which have timed out, but which the app is still handling.'''
+        return self._abandoned
+
+    def _abandon(self, cancel):
+        # Called when we stop waiting for the app; _reclaim must be called once the app
+        # has stopped working on the request.
+        cancel.set()
+        with self._counter_lock:
+            self._abandoned += 1
+
+    def _reclaim(self):
+        with self._counter_lock:
+            self._abandoned -= 1
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    def _make_host_environ(self, scheme, netloc):
+        host, port = _split_netloc(scheme, netloc)
+        environ = {
+            'HTTP_HOST': netloc,
+            'SERVER_NAME': host,
+            'SERVER_PORT': port,
+            'wsgi.url_scheme': scheme,
+        }
+
+        # Don't override anything that has been set explicitly.
+        for key in self.extra_environ:
+            environ.pop(key, None)
+        return environ
+
+    def _make_environ(self, request):
+        scheme, netloc, path, query = _URL_PARTS.match(request.url).groups()
+
+        # PEP 3333 says that the path should be the undecoded bytes, but as a
+        # native string (so latin-1 decoded on Python 3).
+        if not path:
+            path = '/'
+        elif '%' in path:
+            path = unquote_to_bytes(path)
+            if not six.PY2:
+                path = path.decode('latin-1')
+
+        environ = self._environ_template.copy()
+        environ.update(self._host_environ(scheme, netloc))
+        environ['REQUEST_METHOD'] = request.method
+        environ['PATH_INFO'] = path
+        environ['QUERY_STRING'] = query or ''
+
+        _headers_to_environ(request.headers, environ)
+
+        # Streamed bodies are passed on without being read in first; if we don't know how
+        # long they are, then we tell the app to read until the input is exhausted.
+        body = request.body
+        if isinstance(body, six.text_type):
+            body = body.encode('utf-8')
+        environ['wsgi.input'] = _wsgi_input(body)
+        if 'CONTENT_LENGTH' not in environ:
+            if isinstance(body, bytes):
+                if body:
+                    environ['CONTENT_LENGTH'] = str(len(body))
+            elif body is not None:
+                environ['wsgi.input_terminated'] = True
+        return environ
+
+    def _call_app(self, environ):
+        return AppResponse(self.app, environ)
+
+    def _invoke_handler(self, handler, params, timeout, cancel=None):
+        # Handle synchronously if there's no timeout.
+        if not timeout:
+            return handler(**params)
+
+        if self.max_abandoned is not None and self._abandoned >= self.max_abandoned:
+            raise ConnectionError('%d timed out requests are still being handled by the app'
+                                  % self._abandoned)
+
+        # As there is a timeout, we'll execute it in a separate thread.
+        if self.executor is not None:
+            return self._invoke_in_executor(handler, params, timeout, cancel)
+
+        # We store the result at index 0, whether the request has finished at index 1, and
+        # the current thread will signal to the spawned thread if it has cancelled its
+        # request at index 2.
+        result = [None, False, False]
+        lock = threading.Lock()
+
+        def invoke_request():
+            try:
+                value = handler(**params)
+            except Exception as e:  # pragma: no cover
+                value = e
+            with lock:
+                result[0], result[1] = value, True
+                cancelled = result[2]
+            if cancelled:
+                # This prevents the webtest linter from generating a warning about the
+                # iterable response not being closed properly.
+                try:
+                    if not isinstance(value, Exception):
+                        iter_close(value._app_iter)  # Tidy up the request.
+                finally:
+                    self._reclaim()
+
+        thread = threading.Thread(target=invoke_request)
+        thread.start()
+        thread.join(timeout=timeout)
+        with lock:
+            if not result[1]:
+                result[2] = True  # tell the thread we don't want the result
+        if result[2]:
+            self._abandon(cancel)
+            raise Timeout()
+        if isinstance(result[0], Exception):  # pragma: no cover
+            raise result[0]  # pylint: disable=raising-bad-type
+        return result[0]
+
+    def _invoke_in_executor(self, handler, params, timeout, cancel=None):
+        def invoke_request():
+            with self._counter_lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return handler(**params)
+            finally:
+                with self._counter_lock:
+                    self._active -= 1
+
+        with self._counter_lock:
+            self._queued += 1
+        future = self.executor.submit(invoke_request)
+        try:
+            return future.result(timeout=timeout)
+        except futures.TimeoutError:
+            if future.cancel():
+                with self._counter_lock:
+                    self._queued -= 1
+            else:
+                # Tidy up the request once it's done (or now, if it has just finished).
+                self._abandon(cancel)
+                future.add_done_callback(self._close_abandoned)
+            raise Timeout()
+
+    def _close_abandoned(self, future):
+        try:
+            if future.exception() is None:
+                iter_close(future.result()._app_iter)
+        finally:
+            self._reclaim()
+
+
+def _split_netloc(scheme, netloc):
+    host, _, port = netloc.rpartition(':')
+    if not host or ']' in port:  # No port, or an IPv6 address without one.
+        host, port = netloc, '443' if scheme == 'https' else '80'
+    return host, port
+
+
+def _make_response(request, status_code, reason, headerlist, body, stream=True,
+                   spool_threshold=None):
+    resp = Response()
+    resp.status_code = status_code
+    resp.reason = reason
+    resp.url = request.url
+
+    # Although HTTPHeaderDict is better positioned to handle multiple headers with the same
+    # name, requests doesn't use this type for responses. Instead, it uses its own dictionary
+    # type for headers (which doesn't have multiple header value support).
+    #
+    # But because requests builds it from an HTTPHeaderDict object, all multiple value
+    # headers will be compiled together, so that's what we store here (to be consistent with
+    # requests).
+    #
+    # It would be nice to use HTTPHeaderDict for the response, but we don't want to provide a
+    # different object with a different API.
+    _merge_headers(resp.headers, headerlist)
+
+    resp.request = request
+    if not stream:
+        _load_content(resp, body)
+    elif _read_file_directly(resp, body):
+        pass  # The body will be read straight from the file the app returned.
+    elif spool_threshold is not None:
+        _spool_content(resp, body, spool_threshold)
+    else:
+        resp.raw = IterStringIO(body)
+    return resp
+
+
+def _load_content(resp, body):
+    # Reads the whole body straight from the app iterable and hands it to requests as the
+    # response content, so that it isn't read back out of resp.raw a piece at a time.
+    if _read_file_directly(resp, body):
+        with resp.raw:
+            content = resp.raw.read()
+        resp._content = content
+        resp._content_consumed = True
+        return
+    try:
+        chunks = [chunk for chunk in body if chunk]
+    finally:
+        iter_close(body)
+    content = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+    resp._content = content if isinstance(content, bytes) else bytes(content)
+    resp._content_consumed = True
+    resp.raw = IterStringIO(())
+
+
+def _read_file_directly(resp, wrapper):
+    # Sets up resp.raw to read from the file descriptor underneath a file_wrapper, if it
+    # has one that can be read from with os.pread.
+    if type(wrapper) is not FileWrapper or not hasattr(os, 'pread'):
+        return False
+    try:
+        fileno = wrapper.filelike.fileno()
+        position = wrapper.filelike.tell()
+        size = os.fstat(fileno).st_size
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return False
+    resp.raw = FileReader(wrapper, fileno, position, size)
+    return True
+
+
+def _spool_content(resp, body, threshold):
+    # Reads the whole body from the app, keeping it in memory until it grows beyond the
+    # threshold, and then writing it to a temporary file instead.
+    chunks, size, spool = [], 0, None
+    try:
+        for chunk in body:
+            if not chunk:
+                continue
+            size += len(chunk)
+            if spool is not None:
+                spool.write(chunk)
+                continue
+            chunks.append(chunk)
+            if size > threshold:
+                spool = tempfile.TemporaryFile()
+                spool.writelines(chunks)
+                chunks = None
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        raise
+    finally:
+        iter_close(body)
+
+    if spool is None:
+        resp.raw = IterStringIO(chunks)
+    else:
+        spool.flush()
+        resp.raw = MappedReader(spool, size)
+
+
+# Maps header names to their WSGI environment keys; only a limited number of names are
+# remembered, so that unusual headers don't make this grow without limit.
+_ENVIRON_KEYS = {'Content-Type': 'CONTENT_TYPE', 'Content-Length': 'CONTENT_LENGTH'}
+_ENVIRON_KEYS_LIMIT = 512
+
+
+def _environ_key(name):
+    key = name.upper().replace('-', '_')
+    if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        key = 'HTTP_' + key
+    if len(_ENVIRON_KEYS) < _ENVIRON_KEYS_LIMIT:
+        _ENVIRON_KEYS[name] = key
+    return key
+
+
+def _headers_to_environ(headers, environ):
+    keys = _ENVIRON_KEYS
+    for name, value in headers.items():
+        key = keys.get(name)
+        environ[key or _environ_key(name)] = value
+
+
+def _merge_headers(headers, headerlist):
+    # Puts the headers straight into the CaseInsensitiveDict's underlying store, which maps
+    # lowercased names to the original name and value. Repeated headers are joined with commas
+    # in the same way as HTTPHeaderDict, keeping the name as it was first given.
+    store = headers._store  # pylint: disable=protected-access
+    for name, value in headerlist:
+        lower = name.lower()
+        existing = store.get(lower)
+        if existing is None:
+            store[lower] = (name, value)
+        else:
+            store[lower] = (existing[0], existing[1] + ', ' + value)
+
+
+def _encode_chunks(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8') if isinstance(chunk, six.text_type) else chunk
+
+
+def _wsgi_input(body):
+    if body is None:
+        return io.BytesIO()
+    elif isinstance(body, bytes):
+        return io.BytesIO(body)  # This shares the underlying buffer rather than copying it.
+    elif hasattr(body, 'read'):
+        # File objects can be given to the app directly, so it reads straight from them.
+        if hasattr(body, 'readline'):
+            return body
+        return IterStringIO(iter(lambda: body.read(io.DEFAULT_BUFFER_SIZE), b''))
+    else:
+        return IterStringIO(_encode_chunks(body))
+
+
+class AppResponse(object):
+
+    # Calls a WSGI app directly, and exposes the result with the same attribute names
+    # as TestResponse, so that the adapter can treat them in the same way.
+
+    def __init__(self, app, environ):
+        self.status = self.headerlist = None
+        self._headers_sent = False
+        self._written = []
+        app_iter = chunks = app(environ, self.start_response)
+
+        # The app may defer calling start_response until the first chunk of the body
+        # is produced, so we may need to pull that chunk forward.
+        if self.status is None:
+            chunks = iter(app_iter)
+            for chunk in chunks:
+                self._written.append(chunk)
+                if self.status is not None:
+                    break
+            else:
+                iter_close(app_iter)
+                raise RuntimeError('WSGI app did not call start_response')
+
+        self._headers_sent = True
+        if self._written:
+            app_iter = _ChainedIterable(self._written, chunks, app_iter)
+        self._app_iter = app_iter
+
+    def start_response(self, status, headerlist, exc_info=None):
+        if exc_info:
+            try:
+                if self._headers_sent:
+                    six.reraise(*exc_info)
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError('start_response has already been called')
+        self.status, self.headerlist = status, headerlist
+        return self._written.append
+
+
+class _ChainedIterable(object):
+
+    def __init__(self, head, rest, closeable):
+        self.head = head
+        self.rest = rest
+        self.closeable = closeable
+
+    def __iter__(self):
+        for chunk in self.head:
+            yield chunk
+        for chunk in self.rest:
+            yield chunk
+
+    def close(self):
+        iter_close(self.closeable)
+
+
+class PyriformTestResponse(TestResponse):
+
+    # This suppresses the entire body content being consumed before being
+    # returned.
+    body = property(lambda self: None)
+
+
+class PyriformTestRequest(TestRequest):
+    ResponseClass = PyriformTestResponse
+
+
+# Marks the end of a body being read by _TimedBody.
+_END = object()
+
+
+class _TimedBody(object):
+
+    # Reads each chunk of a response body in a background thread, so that we can stop
+    # waiting for the app if it takes longer than the timeout to produce one.
+
+    def __init__(self, adapter, iterable, timeout, cancel):
+        self.adapter = adapter
+        self.iterable = iterable
+        self.timeout = timeout
+        self.cancel = cancel
+        self.executor = adapter.executor
+        self._own_executor = self.executor is None
+        self._pending = None
+
+    def __iter__(self):
+        iterator = iter(self.iterable)
+        if self._own_executor:
+            self.executor = futures.ThreadPoolExecutor(max_workers=1)
+        while True:
+            self._pending = future = self.executor.submit(next, iterator, _END)
+            try:
+                chunk = future.result(timeout=self.timeout)
+            except futures.TimeoutError:
+                # Stop consuming the body, and leave the app to finish off the chunk it's
+                # working on - it will be closed once it has.
+                self.adapter._abandon(self.cancel)
+                future.add_done_callback(self._close_abandoned)
+                raise ReadTimeout()
+            self._pending = None
+            if chunk is _END:
+                return
+            yield chunk
+
+    def _close_abandoned(self, future):
+        try:
+            self._close_iterable()
+        finally:
+            self.adapter._reclaim()
+
+    def _close_iterable(self):
+        try:
+            iter_close(self.iterable)
+        finally:
+            if self._own_executor and self.executor is not None:
+                self.executor.shutdown(wait=False)
+
+    def close(self):
+        if self._pending is None:
+            self._close_iterable()
+
+
+class FileWrapper(object):
+
+    '''The ``wsgi.file_wrapper`` provided to apps (see :pep:`3333`).
+
+    Apps can return one of these to send the contents of a file. When the file is a real
+    file, the adapter doesn't iterate over it at all - ``resp.raw`` reads directly from the
+    file descriptor instead (see :py:class:`FileReader`).
+    '''
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return iter(lambda: self.filelike.read(self.blksize), b'')
+
+
+class FileReader(io.BufferedIOBase):
+
+    '''Reads a response body straight from the file descriptor of a :py:class:`FileWrapper`.
+
+    Reads use :py:func:`os.pread` (or :py:func:`os.preadv` to read directly into a buffer
+    where it is available), starting from wherever the file was positioned when the app
+    returned it. The reader is seekable, and closing it closes the wrapped file.
+    '''
+
+    def __init__(self, wrapper, fileno, position, size):
+        super(FileReader, self).__init__()
+        self.wrapper = wrapper
+        self._fileno = fileno
+        self._start = position
+        self.size = max(size - position, 0)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self._fileno
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._pos = offset
+        return offset
+
+    def read(self, n=None):
+        if self.closed:
+            raise ValueError('read of closed file')
+        remaining = max(self.size - self._pos, 0)
+        n = remaining if n is None or n < 0 else min(n, remaining)
+        data = os.pread(self._fileno, n, self._start + self._pos) if n else b''
+        self._pos += len(data)
+        return data
+
+    read1 = read
+
+    def readinto(self, b):
+        if not hasattr(os, 'preadv'):
+            return super(FileReader, self).readinto(b)
+        if self.closed:
+            raise ValueError('read of closed file')
+        view = memoryview(b).cast('B')
+        view = view[:max(min(len(view), self.size - self._pos), 0)]
+        size = os.preadv(self._fileno, [view], self._start + self._pos) if view else 0
+        self._pos += size
+        return size
+
+    readinto1 = readinto
+
+    def close(self):
+        if not self.closed:
+            iter_close(self.wrapper)
+        super(FileReader, self).close()
+
+
+class MappedReader(io.BufferedIOBase):
+
+    '''A seekable reader for a response body which has been spooled to a file.
+
+    The file is memory-mapped, so reads are served straight from the page cache, and
+    :py:meth:`readinto` copies directly into the caller's buffer. The file is closed (and so
+    removed, if it is a temporary file) when the reader is closed.
+
+    Args:
+        fileobj (file object): The file containing the body.
+        size (int): The length of the body, which must be at least one byte.
+    '''
+
+    def __init__(self, fileobj, size):
+        super(MappedReader, self).__init__()
+        self.file = fileobj
+        self.size = size
+        self._map = mmap.mmap(fileobj.fileno(), size, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._pos = offset
+        return offset
+
+    def _take(self, n):
+        start = min(self._pos, self.size)
+        end = self.size if n is None or n < 0 else min(start + n, self.size)
+        self._pos = end
+        return self._view[start:end]
+
+    def read(self, n=None):
+        if self.closed:
+            raise ValueError('read of closed file')
+        return self._take(n).tobytes()
+
+    read1 = read
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('read of closed file')
+        view = memoryview(b).cast('B')
+        data = self._take(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    readinto1 = readinto
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            self._map.close()
+            self.file.close()
+        super(MappedReader, self).close()
+
+
+class IterStringIO(io.BufferedIOBase):
+
+    # Reads are served a chunk at a time from the app iterable. Whatever is
+    # left over from the last chunk is held as a memoryview, so slicing it
+    # never copies the underlying data.
+
+    def __init__(self, iterable):
+        super(IterStringIO, self).__init__()
+        self.iterable = iterable
+        self.iter = iter(iterable)
+        self.leftover = None
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        # Returns the next piece of unread data (either a leftover memoryview
+        # or a fresh chunk from the iterable), or None if we're exhausted.
+        if self.leftover is not None:
+            chunk, self.leftover = self.leftover, None
+            return chunk
+        if self.closed:
+            return None
+        for chunk in self.iter:
+            if chunk:
+                return chunk
+
+        # The app has finished, so we can let it tidy up now.
+        iterable, self.iterable, self.iter = self.iterable, (), iter(())
+        iter_close(iterable)
+        return None
+
+    def _push_back(self, chunk, n):
+        # Keep everything after the first n bytes of chunk for the next read.
+        if n < len(chunk):
+            self.leftover = memoryview(chunk)[n:]
+
+    def read1(self, n=-1):
+        chunk = self._next_chunk()
+        if chunk is None:
+            return b''
+        if n is not None and 0 <= n < len(chunk):
+            self._push_back(chunk, n)
+            chunk = memoryview(chunk)[:n]
+        return chunk if isinstance(chunk, bytes) else chunk.tobytes()
+
+    def read(self, n=None):
+        if n is None or n < 0:
+            return b''.join(iter(self.read1, b''))
+
+        # Hand back the chunk as-is if it is exactly what was asked for,
+        # otherwise gather data from as many chunks as we need.
+        chunk = self.read1(n)
+        if not chunk or len(chunk) == n:
+            return chunk
+        buf = bytearray(n)
+        size = self.readinto(memoryview(buf)[len(chunk):]) + len(chunk)
+        buf[:len(chunk)] = chunk
+        del buf[size:]
+        return bytes(buf)
+
+    def readinto1(self, b):
+        chunk = self._next_chunk()
+        if chunk is None:
+            return 0
+        size = min(len(b), len(chunk))
+        b[:size] = memoryview(chunk)[:size]
+        self._push_back(chunk, size)
+        return size
+
+    def readinto(self, b):
+        view = memoryview(b)
+        size = 0
+        while size < len(view):
+            n = self.readinto1(view[size:])
+            if not n:
+                break
+            size += n
+        return size
+
+    def close(self):
+        if hasattr(self, 'iterable'):
+            iter_close(self.iterable)
+            del self.iterable
+            del self.iter
+            self.leftover = None
+        super(IterStringIO, self).close()
@@ -0,0 +1,328 @@
+'''Adapters for connecting to ASGI apps, rather than WSGI apps.
+
+This module requires Python 3; :py:class:`ASGITransport` additionally requires the
+`httpx <https://www.python-httpx.org/>`_ library.
+'''
+import asyncio
+from concurrent import futures
+from http.client import responses
+import threading
+from urllib.parse import unquote
+
+from requests import Timeout
+from requests.adapters import BaseAdapter
+
+from pyriform import _URL_PARTS, _make_response, _split_netloc
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+__all__ = ['ASGIAdapter', 'ASGITransport']
+
+# Marks the end of the response body in the queue of body chunks.
+_END = object()
+
+
+def make_scope(method, url, headers, root_path='', extra_scope=None):
+    '''Builds an ASGI ``http`` connection scope for a request.
+
+    The URL and host are mapped in the same way that :py:class:`~pyriform.WSGIAdapter` maps
+    them to a WSGI environment.
+
+    Args:
+        method (string): The request method.
+        url (string): The full request URL.
+        headers (list of (string, string) tuples): The request headers.
+        root_path (string): The path that the app is mounted at.
+        extra_scope (dict): Extra values to put into the scope.
+
+    Returns:
+        A dictionary to pass to the ASGI app.
+    '''
+    scheme, netloc, path, query = _URL_PARTS.match(url).groups()
+    host, port = _split_netloc(scheme, netloc)
+    path = path or '/'
+
+    scope_headers = []
+    has_host = False
+    for name, value in headers:
+        name = name.lower()
+        has_host = has_host or name == 'host'
+        scope_headers.append((name.encode('latin-1'), value.encode('latin-1')))
+    if not has_host:
+        scope_headers.insert(0, (b'host', netloc.encode('latin-1')))
+
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0', 'spec_version': '2.3'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': scheme,
+        'path': unquote(path),
+        'raw_path': path.encode('latin-1'),
+        'query_string': (query or '').encode('latin-1'),
+        'root_path': root_path,
+        'headers': scope_headers,
+        'client': None,
+        'server': (host, int(port)),
+        'extensions': {},
+    }
+    if extra_scope:
+        scope.update(extra_scope)
+    return scope
+
+
+class ASGICall(object):
+
+    '''Runs a single request through an ASGI app without any sockets.
+
+    Args:
+        app (ASGI application): The app to send the request to.
+        scope (dict): The connection scope (see :py:func:`make_scope`).
+        body (async iterable of bytes): The request body, if there is one.
+    '''
+
+    def __init__(self, app, scope, body=None):
+        self.app = app
+        self.scope = scope
+        self.body = None if body is None else body.__aiter__()
+        self.task = None
+        self.status = self.headers = None
+
+    async def start(self):
+        '''Calls the app, and waits until it has started its response.
+
+        Returns:
+            A tuple of the status code and a list of (name, value) header tuples.
+        '''
+        loop = asyncio.get_running_loop()
+        self.started = loop.create_future()
+        self.finished = asyncio.Event()
+        self.chunks = asyncio.Queue(maxsize=8)
+        self.task = loop.create_task(self._run())
+        return await self.started
+
+    async def _run(self):
+        try:
+            await self.app(self.scope, self.receive, self.send)
+        except Exception as e:
+            if not self.started.done():
+                self.started.set_exception(e)
+            else:
+                await self.chunks.put(e)
+        else:
+            if not self.started.done():
+                self.started.set_exception(
+                    RuntimeError('ASGI app did not start a response'))
+        finally:
+            if not self.finished.is_set():
+                self.finished.set()
+                await self.chunks.put(_END)
+
+    async def receive(self):
+        if self.body is not None:
+            try:
+                chunk = await self.body.__anext__()
+            except StopAsyncIteration:
+                self.body = None
+            else:
+                return {'type': 'http.request', 'body': bytes(chunk), 'more_body': True}
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        # Once the body has been read, the app will only hear from us again
+        # when the response has been sent, or the client has gone away.
+        await self.finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                            for (name, value) in message.get('headers', ())]
+            self.started.set_result((self.status, self.headers))
+        elif message['type'] == 'http.response.body' and not self.finished.is_set():
+            body = message.get('body', b'')
+            if body:
+                await self.chunks.put(body)
+            if not message.get('more_body', False):
+                self.finished.set()
+                await self.chunks.put(_END)
+
+    async def next_chunk(self):
+        '''Returns the next chunk of the response body, or ``None`` if there is no more.'''
+        chunk = await self.chunks.get()
+        if chunk is _END:
+            self.chunks.put_nowait(_END)  # Keep returning None if we're called again.
+            return None
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    async def aclose(self):
+        '''Abandons the request, telling the app that the client has disconnected.'''
+        if not self.finished.is_set():
+            self.finished.set()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:  # pylint: disable=broad-except
+                pass
+
+
+class ASGIAdapter(BaseAdapter):
+
+    '''A Requests adapter that will connect to an ASGI app.
+
+    This is the ASGI counterpart to :py:class:`~pyriform.WSGIAdapter`. All requests are
+    handled on a single event loop, which runs in a background thread - so concurrent
+    requests from different threads are multiplexed on that loop.
+
+    Args:
+        app (ASGI application): The app to send requests to - this should be a
+            coroutine function which takes three arguments: *scope*, *receive* and *send*.
+        extra_scope (dict): Extra values that will be put into the scope of every request
+            that the app handles.
+        root_path (string): The path that the app is mounted at.
+    '''
+    def __init__(self, app, extra_scope=None, root_path=''):
+        super(ASGIAdapter, self).__init__()
+        self.app = app
+        self.extra_scope = extra_scope
+        self.root_path = root_path
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @property
+    def loop(self):
+        '''The event loop that requests are handled on (started on first use).'''
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever,
+                                          name='pyriform-asgi', daemon=True)
+                thread.start()
+            return self._loop
+
+    def _run(self, coro, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout=timeout)
+        except futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+
+        scope = make_scope(request.method, request.url, request.headers.items(),
+                           self.root_path, self.extra_scope)
+        call = ASGICall(self.app, scope, _aiter_body(request.body))
+
+        # We only care about the read timeout.
+        if isinstance(timeout, tuple):
+            _, timeout = timeout
+
+        try:
+            status, headers = self._run(call.start(), timeout=timeout or None)
+        except futures.TimeoutError:
+            self._run(call.aclose())
+            raise Timeout()
+        return _make_response(request, status, responses.get(status, ''), headers,
+                              _SyncBody(self, call), stream)
+
+    def close(self):
+        with self._loop_lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+
+
+class _SyncBody(object):
+
+    # Exposes the response body of an ASGICall running in the adapter's event loop as
+    # an ordinary iterable.
+
+    def __init__(self, adapter, call):
+        self.adapter = adapter
+        self.call = call
+
+    def __iter__(self):
+        while True:
+            chunk = self.adapter._run(self.call.next_chunk())
+            if chunk is None:
+                break
+            yield chunk
+
+    def close(self):
+        self.adapter._run(self.call.aclose())
+
+
+async def _aiter_body(body):
+    if body is None:
+        return
+    elif isinstance(body, str):
+        yield body.encode('utf-8')
+    elif isinstance(body, (bytes, bytearray, memoryview)):
+        yield body
+    elif hasattr(body, 'read'):
+        for chunk in iter(lambda: body.read(65536), b''):
+            yield chunk
+    else:
+        for chunk in body:
+            yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+if httpx is not None:
+    _TransportBase, _StreamBase = httpx.AsyncBaseTransport, httpx.AsyncByteStream
+else:  # pragma: no cover
+    _TransportBase = _StreamBase = object
+
+
+class ASGITransport(_TransportBase):
+
+    '''An asynchronous transport for :py:class:`httpx.AsyncClient` which talks to an ASGI app.
+
+    The app is run in the same event loop as the client, and both the request and response
+    bodies are streamed, so many requests can be in progress at the same time.
+
+    Args:
+        app (ASGI application): The app to send requests to.
+        extra_scope (dict): Extra values that will be put into the scope of every request
+            that the app handles.
+        root_path (string): The path that the app is mounted at.
+    '''
+    def __init__(self, app, extra_scope=None, root_path=''):
+        if httpx is None:  # pragma: no cover
+            raise ImportError('ASGITransport requires httpx to be installed')
+        self.app = app
+        self.extra_scope = extra_scope
+        self.root_path = root_path
+
+    async def handle_async_request(self, request):
+        headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                   for (name, value) in request.headers.raw]
+        scope = make_scope(request.method, str(request.url), headers,
+                           self.root_path, self.extra_scope)
+        call = ASGICall(self.app, scope, request.stream)
+        status, headers = await call.start()
+        return httpx.Response(status, headers=headers, stream=_AsyncBody(call),
+                              extensions={'reason_phrase': responses.get(status, '').encode()})
+
+
+class _AsyncBody(_StreamBase):
+
+    def __init__(self, call):
+        self.call = call
+
+    async def __aiter__(self):
+        while True:
+            chunk = await self.call.next_chunk()
+            if chunk is None:
+                break
+            yield chunk
+
+    async def aclose(self):
+        await self.call.aclose()
@@ -0,0 +1,293 @@
+'''A response cache for adapters, which follows HTTP caching rules.
+
+Give a :py:class:`ResponseCache` to :py:class:`~pyriform.WSGIAdapter` to have repeated
+``GET`` and ``HEAD`` requests served without calling the app again::
+
+    >>> from pyriform import make_session
+    >>> from pyriform.cache import ResponseCache
+    >>> calls = []
+    >>> def app(environ, start_response):
+    ...     calls.append(environ['PATH_INFO'])
+    ...     start_response('200 OK', [('Cache-Control', 'max-age=60')])
+    ...     return [b'Hello']
+    >>> cache = ResponseCache(maxsize=100)
+    >>> session = make_session(app, cache=cache)
+    >>> [session.get('http://app.local/hello').text for _ in range(3)]
+    ['Hello', 'Hello', 'Hello']
+    >>> len(calls), cache.hits, cache.misses
+    (1, 2, 1)
+'''
+from collections import OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+import threading
+import time
+
+__all__ = ['ResponseCache']
+
+# Status codes which can be cached by default (RFC 7231, section 6.1).
+CACHEABLE_STATUSES = frozenset([200, 203, 204, 300, 301, 404, 405, 410, 414, 501])
+
+# Request headers which mean that the caller is handling validation itself.
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since', 'If-Match',
+                       'If-Unmodified-Since', 'If-Range', 'Range')
+
+# Headers in a 304 response which shouldn't replace the stored ones.
+KEEP_ON_REVALIDATION = frozenset(['content-length', 'content-encoding', 'transfer-encoding',
+                                  'content-range'])
+
+
+def parse_cache_control(value):
+    '''Parses a ``Cache-Control`` header value into a dictionary.
+
+    Directives without a value are mapped to ``True``.
+
+        >>> sorted(parse_cache_control('no-cache, max-age="60"').items())
+        [('max-age', '60'), ('no-cache', True)]
+    '''
+    directives = {}
+    for part in (value or '').split(','):
+        name, sep, arg = part.partition('=')
+        name = name.strip().lower()
+        if name:
+            directives[name] = arg.strip().strip('"') if sep else True
+    return directives
+
+
+def _parse_date(value):
+    parsed = parsedate_tz(value) if value else None
+    return mktime_tz(parsed) if parsed else None
+
+
+def _get_header(headerlist, name):
+    name = name.lower()
+    values = [v for (k, v) in headerlist if k.lower() == name]
+    return ', '.join(values) if values else None
+
+
+class CacheEntry(object):
+
+    '''A stored response.
+
+    Attributes:
+        status_code (int): The response status code.
+        reason (string): The response reason.
+        headerlist (list of (string, string) tuples): The response headers.
+        body (bytes): The response body - this is never modified, so it can be handed
+            out to any number of responses without being copied.
+        stored (float): When the response was stored (or last revalidated).
+        created (float): When the response was first stored.
+    '''
+
+    __slots__ = ['status_code', 'reason', 'headerlist', 'body', 'stored', 'created',
+                 'lifetime', 'no_cache']
+
+    def __init__(self, status_code, reason, headerlist, body, now):
+        self.status_code = status_code
+        self.reason = reason
+        self.body = body
+        self.created = now
+        self._update(headerlist, now)
+
+    def _update(self, headerlist, now):
+        self.headerlist = list(headerlist)
+        self.stored = now
+        directives = parse_cache_control(_get_header(headerlist, 'Cache-Control'))
+        self.no_cache = 'no-cache' in directives
+
+        # Work out how long the response is fresh for - without any explicit information,
+        # we treat it as immediately stale (so it has to be revalidated before being used).
+        self.lifetime = 0
+        if 'max-age' in directives:
+            try:
+                self.lifetime = max(0, int(directives['max-age']))
+            except ValueError:
+                pass
+        else:
+            expires = _parse_date(_get_header(headerlist, 'Expires'))
+            if expires is not None:
+                date = _parse_date(_get_header(headerlist, 'Date')) or now
+                self.lifetime = max(0, expires - date)
+
+    def is_fresh(self, now):
+        return not self.no_cache and now - self.stored < self.lifetime
+
+    def validators(self):
+        '''Returns the headers to send to check whether this response is still valid.'''
+        headers = {}
+        etag = _get_header(self.headerlist, 'ETag')
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        last_modified = _get_header(self.headerlist, 'Last-Modified')
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def revalidated(self, headerlist, now):
+        '''Updates the entry with the headers from a ``304 Not Modified`` response.'''
+        replaced = dict((k.lower(), v) for (k, v) in headerlist
+                        if k.lower() not in KEEP_ON_REVALIDATION)
+        merged = [(k, v) for (k, v) in self.headerlist if k.lower() not in replaced]
+        merged.extend((k, v) for (k, v) in headerlist if k.lower() in replaced)
+        self._update(merged, now)
+
+    def result(self):
+        return self.status_code, self.reason, list(self.headerlist), [self.body]
+
+
+class ResponseCache(object):
+
+    '''A bounded cache of responses, with least-recently-used eviction.
+
+    Responses are only stored if they are allowed to be by their status code and
+    ``Cache-Control`` header, and if they are either fresh for some amount of time
+    (``max-age`` or ``Expires``), or can be revalidated (``ETag`` or ``Last-Modified``).
+    When a stored response is stale, a conditional request is sent to the app, and the
+    stored response is used if the app says it hasn't changed. ``Vary`` is honoured, and
+    requests which have their own conditional headers, or which have ``Cache-Control:
+    no-store``, bypass the cache.
+
+    Bodies are only stored once they have been read in full.
+
+    Args:
+        maxsize (int): The maximum number of responses to store.
+        ttl (float): If given, responses are evicted this many seconds after they were first
+            stored, even if they are still being used.
+
+    Attributes:
+        hits (int): The number of requests served from the cache (including ones which
+            were revalidated).
+        misses (int): The number of requests which had to be sent to the app in full.
+        revalidations (int): The number of stored responses which the app confirmed were
+            still valid.
+        evictions (int): The number of responses which have been dropped from the cache.
+    '''
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = self.revalidations = self.evictions = 0
+        self._entries = OrderedDict()
+        self._vary = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        '''Removes all of the stored responses.'''
+        with self._lock:
+            self._entries.clear()
+            self._vary.clear()
+
+    def _key(self, request):
+        base = (request.method, request.url)
+        names = self._vary.get(base, ())
+        return base + tuple(request.headers.get(name) for name in names)
+
+    def _get(self, key, now):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if self.ttl is not None and now - entry.created >= self.ttl:
+                    self.evictions += 1
+                    return None
+                self._entries[key] = entry  # Now the most recently used.
+            return entry
+
+    def _put(self, request, vary, entry):
+        with self._lock:
+            base = (request.method, request.url)
+            self._vary[base] = vary
+            key = base + tuple(request.headers.get(name) for name in vary)
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                (method, url) = self._entries.popitem(last=False)[0][:2]
+                self.evictions += 1
+                if not any(k[:2] == (method, url) for k in self._entries):
+                    self._vary.pop((method, url), None)
+
+    def handle(self, call, request, stream, timeout, timings=None):
+        '''Handles a request, using *call* to send it to the app if it can't be served
+        from the cache.
+
+        *call* should take the same arguments as this method (other than itself), and
+        return a tuple of the status code, reason, header list and body iterable - which
+        is what is returned here too.
+        '''
+        if request.method not in ('GET', 'HEAD') or \
+                'no-store' in parse_cache_control(request.headers.get('Cache-Control')) or \
+                any(h in request.headers for h in CONDITIONAL_HEADERS):
+            return call(request, stream, timeout, timings)
+
+        now = time.time()
+        entry = self._get(self._key(request), now)
+        if entry is not None:
+            request_directives = parse_cache_control(request.headers.get('Cache-Control'))
+            if entry.is_fresh(now) and 'no-cache' not in request_directives:
+                self.hits += 1
+                return entry.result()
+
+            validators = entry.validators()
+            if validators:
+                conditional = request.copy()
+                conditional.headers.update(validators)
+                result = call(conditional, stream, timeout, timings)
+                if result[0] == 304:
+                    _close(result[3])
+                    entry.revalidated(result[2], time.time())
+                    self.hits += 1
+                    self.revalidations += 1
+                    return entry.result()
+                self.misses += 1
+                return self._store(request, result)
+
+        self.misses += 1
+        return self._store(request, call(request, stream, timeout, timings))
+
+    def _store(self, request, result):
+        status_code, reason, headerlist, body = result
+        if status_code not in CACHEABLE_STATUSES:
+            return result
+        if 'no-store' in parse_cache_control(_get_header(headerlist, 'Cache-Control')):
+            return result
+        vary = _get_header(headerlist, 'Vary')
+        vary = tuple(sorted(set(v.strip().lower() for v in (vary or '').split(',')
+                                if v.strip())))
+        if '*' in vary:
+            return result
+
+        entry = CacheEntry(status_code, reason, headerlist, None, time.time())
+        if not entry.lifetime and not entry.validators():
+            return result
+
+        def on_complete(content):
+            entry.body = content
+            self._put(request, vary, entry)
+
+        return status_code, reason, headerlist, _CapturingIterable(body, on_complete)
+
+
+def _close(iterable):
+    close = getattr(iterable, 'close', None)
+    if close is not None:
+        close()
+
+
+class _CapturingIterable(object):
+
+    # Passes the body through, and hands all of it to a callback if it was read in full.
+
+    def __init__(self, iterable, on_complete):
+        self.iterable = iterable
+        self.on_complete = on_complete
+
+    def __iter__(self):
+        chunks = []
+        for chunk in self.iterable:
+            chunks.append(chunk)
+            yield chunk
+        self.on_complete(b''.join(chunks))
+
+    def close(self):
+        _close(self.iterable)
@@ -0,0 +1,225 @@
+'''Instrumentation for seeing where the time goes when an adapter handles a request.
+
+Pass an instrument to :py:class:`~pyriform.WSGIAdapter` to have it notified about each
+request that it handles::
+
+    >>> from pyriform import make_session
+    >>> from pyriform.instrument import AdapterStats
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [])
+    ...     return [b'Hello', b'World']
+    >>> stats = AdapterStats()
+    >>> session = make_session(app, instrument=stats)
+    >>> print(session.get('http://app.local/').text)
+    HelloWorld
+    >>> stats.requests, stats.body_bytes
+    (1, 10)
+'''
+import cProfile
+import threading
+from timeit import default_timer as clock
+
+__all__ = ['Instrument', 'RequestTimings', 'AdapterStats']
+
+
+class RequestTimings(object):
+
+    '''The timeline of a single request handled by an adapter.
+
+    Each of the time attributes is the number of seconds since the request was started, or
+    ``None`` if that point wasn't reached.
+
+    Attributes:
+        method (string): The request method.
+        url (string): The request URL.
+        status_code (int): The response status code.
+        error (Exception): The exception raised while handling the request, if there was one.
+        prepared: When the request had been converted for the app (e.g. the environ was built).
+        dispatched: When a background thread started handling the request (only for requests
+            with a timeout).
+        handled: When the app had returned its response.
+        converted: When the response had been converted to a :py:class:`~requests.Response`.
+        first_byte: When the app produced the first non-empty chunk of the body.
+        completed: When the app had produced the whole body.
+        closed: When the app's response had been closed.
+        body_bytes (int): The number of bytes in the body that the app produced.
+        body_chunks (int): The number of non-empty chunks that the app produced.
+    '''
+
+    __slots__ = ['method', 'url', 'status_code', 'error', 'start', 'prepared', 'dispatched',
+                 'handled', 'converted', 'first_byte', 'completed', 'closed', 'body_bytes',
+                 'body_chunks']
+
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.status_code = self.error = None
+        self.prepared = self.dispatched = self.handled = self.converted = None
+        self.first_byte = self.completed = self.closed = None
+        self.body_bytes = self.body_chunks = 0
+        self.start = clock()
+
+    def mark(self, name):
+        '''Records that the named point in the request has been reached.'''
+        setattr(self, name, clock() - self.start)
+
+    def phases(self):
+        '''Returns a dictionary mapping the names of each phase of the request to how long
+        it took in seconds (for the phases which were reached).'''
+        points = [('prepare', 'prepared'), ('queue', 'dispatched'), ('handler', 'handled'),
+                  ('convert', 'converted'), ('first_byte', 'first_byte'),
+                  ('body', 'completed'), ('close', 'closed')]
+        result = {}
+        last = 0.0
+        for phase, point in points:
+            value = getattr(self, point)
+            if value is not None:
+                result[phase] = value - last
+                last = value
+        return result
+
+    def __repr__(self):
+        return '<RequestTimings %s %s %s>' % (self.method, self.url, self.status_code)
+
+
+class Instrument(object):
+
+    '''Base class for instruments, which are notified as each request is handled.
+
+    All of the methods do nothing by default, so you only need to override the ones
+    you are interested in. They may be called from different threads at the same time.
+    '''
+
+    def started(self, timings):
+        '''Called with a :py:class:`RequestTimings` object when a request is started.'''
+
+    def sent(self, timings):
+        '''Called when the adapter has returned the response (or raised an exception).'''
+
+    def finished(self, timings):
+        '''Called when the app's response has been closed (or when the request failed).'''
+
+
+class Histogram(object):
+
+    '''A histogram of durations, with buckets for each power of two of microseconds.'''
+
+    def __init__(self):
+        self.buckets = [0] * 40
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = int(seconds * 1e6)
+        self.buckets[min(micros.bit_length(), len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        '''Returns an upper bound (in seconds) for the given percentile (from 0 to 1).'''
+        target = p * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class AdapterStats(Instrument):
+
+    '''An instrument which aggregates counters and histograms for all requests.
+
+    Args:
+        profile (boolean): If true, the parts of each request which are handled in the
+            calling thread are profiled with :py:mod:`cProfile`; the results are available
+            from the :py:attr:`profiler` attribute. Only one request is profiled at a time.
+    '''
+
+    def __init__(self, profile=False):
+        self.lock = threading.Lock()
+        self.requests = self.errors = self.body_bytes = self.body_chunks = 0
+        self.phases = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self._profiling = threading.local()
+        self._profile_lock = threading.Lock()
+
+    def started(self, timings):
+        if self.profiler is not None and self._profile_lock.acquire(False):
+            self._profiling.active = True
+            self.profiler.enable()
+
+    def sent(self, timings):
+        if getattr(self._profiling, 'active', False):
+            self.profiler.disable()
+            self._profiling.active = False
+            self._profile_lock.release()
+
+    def finished(self, timings):
+        phases = timings.phases()
+        with self.lock:
+            self.requests += 1
+            if timings.error is not None:
+                self.errors += 1
+            self.body_bytes += timings.body_bytes
+            self.body_chunks += timings.body_chunks
+            for phase, seconds in phases.items():
+                histogram = self.phases.get(phase)
+                if histogram is None:
+                    histogram = self.phases[phase] = Histogram()
+                histogram.add(seconds)
+
+    def summary(self):
+        '''Returns a dictionary with all of the aggregated counters and the summary of each
+        phase's histogram (durations are in seconds).'''
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'body_bytes': self.body_bytes,
+                'body_chunks': self.body_chunks,
+                'phases': dict((name, h.summary()) for (name, h) in self.phases.items()),
+            }
+
+
+class TimedIterable(object):
+
+    '''Wraps an app iterable, recording when the body is produced and closed.'''
+
+    def __init__(self, iterable, timings, instrument):
+        self.iterable = iterable
+        self.timings = timings
+        self.instrument = instrument
+
+    def __iter__(self):
+        timings = self.timings
+        for chunk in self.iterable:
+            if chunk:
+                if timings.first_byte is None:
+                    timings.mark('first_byte')
+                timings.body_chunks += 1
+                timings.body_bytes += len(chunk)
+            yield chunk
+        timings.mark('completed')
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if self.timings.closed is None:
+                self.timings.mark('closed')
+                self.instrument.finished(self.timings)
@@ -0,0 +1,147 @@
+'''A pool of app instances, for WSGI apps which aren't thread-safe.
+
+Rather than putting a lock around an app (so only one request can be handled at a time),
+you can give :py:class:`~pyriform.WSGIAdapter` an :py:class:`AppPool`, which creates
+several instances of the app and hands each request to one which isn't in use::
+
+    >>> from pyriform import make_session
+    >>> from pyriform.pool import AppPool
+    >>> def make_app():
+    ...     def app(environ, start_response):
+    ...         start_response('200 OK', [])
+    ...         return [b'Hello']
+    ...     return app
+    >>> pool = AppPool(make_app, size=4)
+    >>> session = make_session(pool, raw=True)
+    >>> print(session.get('http://app.local/').text)
+    Hello
+    >>> pool.created, pool.checkouts
+    (1, 1)
+'''
+import threading
+from timeit import default_timer as clock
+
+from requests import Timeout
+
+from pyriform import FileWrapper, iter_close
+
+__all__ = ['AppPool']
+
+
+class AppPool(object):
+
+    '''A WSGI app which hands each request to one of a pool of instances of another app.
+
+    An instance is checked out for the whole of a request - from when it is called, until
+    its response has been closed - so each instance only ever handles one request at a time.
+    Instances are created as they are needed, up to the size of the pool, and are reused
+    most-recently-released first.
+
+    Args:
+        factory (callable): Called with no arguments to create a new instance of the app.
+        size (int): The maximum number of instances to create.
+        timeout (float): How long to wait for an instance to become free before giving up
+            with a :py:class:`~requests.Timeout` error; by default, we wait indefinitely.
+
+    Attributes:
+        created (int): The number of instances which have been created.
+        checkouts (int): The number of requests which have been handed to an instance.
+        contended (int): The number of requests which had to wait for an instance to be
+            released.
+        wait_time (float): The total number of seconds spent waiting for instances.
+        timeouts (int): The number of requests which gave up waiting for an instance.
+    '''
+
+    def __init__(self, factory, size=4, timeout=None):
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.created = self.checkouts = self.contended = self.timeouts = 0
+        self.wait_time = 0.0
+        self._idle = []
+        self._cond = threading.Condition()
+
+    @property
+    def in_use(self):
+        '''The number of instances currently handling a request.'''
+        with self._cond:
+            return self.created - len(self._idle)
+
+    def acquire(self):
+        '''Checks out an instance of the app, waiting for one to be released if needed.'''
+        with self._cond:
+            self.checkouts += 1
+            if self._idle:
+                return self._idle.pop()
+            if self.created < self.size:
+                self.created += 1
+            else:
+                return self._wait()
+        try:
+            return self.factory()
+        except BaseException:
+            with self._cond:
+                self.created -= 1
+                self._cond.notify()
+            raise
+
+    def _wait(self):
+        # Called with the condition held, when every instance is in use.
+        self.contended += 1
+        start = clock()
+        deadline = None if self.timeout is None else start + self.timeout
+        try:
+            while not self._idle:
+                remaining = None if deadline is None else deadline - clock()
+                if remaining is not None and remaining <= 0:
+                    self.timeouts += 1
+                    raise Timeout('timed out waiting for an app instance')
+                self._cond.wait(remaining)
+            return self._idle.pop()
+        finally:
+            self.wait_time += clock() - start
+
+    def release(self, app):
+        '''Returns an instance of the app to the pool.'''
+        with self._cond:
+            self._idle.append(app)
+            self._cond.notify()
+
+    def __call__(self, environ, start_response):
+        app = self.acquire()
+        try:
+            result = app(environ, start_response)
+        except BaseException:
+            self.release(app)
+            raise
+
+        released = []
+
+        def close():
+            try:
+                iter_close(result)
+            finally:
+                if not released:
+                    released.append(True)
+                    self.release(app)
+
+        # Keep file wrappers as they are, so that the adapter can still read them directly.
+        if type(result) is FileWrapper:
+            wrapper = FileWrapper(result.filelike, result.blksize)
+            wrapper.close = close
+            return wrapper
+        return _PooledIterable(result, close)
+
+
+class _PooledIterable(object):
+
+    # Hands the instance back to the pool when the response is closed.
+
+    def __init__(self, iterable, close):
+        self.iterable = iterable
+        self.close = close
+
+    def __iter__(self):
+        return iter(self.iterable)
@@ -0,0 +1,265 @@
+'''Adapters which run the WSGI app outside of the calling thread's interpreter.
+
+Because :py:class:`~pyriform.WSGIAdapter` calls the app in-process, CPU-bound apps are
+limited by the GIL. The adapters here run the app in a pool of worker processes instead;
+each worker imports the app for itself, given a ``module:callable`` specification.
+
+This module requires Python 3.
+'''
+import importlib
+import multiprocessing
+import os
+import queue
+import threading
+
+from requests import ConnectionError, Timeout  # pylint: disable=redefined-builtin
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from pyriform import WSGIAdapter, _make_response, iter_close
+
+__all__ = ['ProcessWSGIAdapter']
+
+
+def load_app(spec):
+    '''Imports a WSGI app from a ``module:callable`` specification.
+
+    The callable part may be a dotted path to an attribute inside the module.
+    '''
+    module_name, _, attr = spec.partition(':')
+    if not attr:
+        raise ValueError('app specification must be in the form module:callable')
+    obj = importlib.import_module(module_name)
+    for name in attr.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+class _WorkerRequest(object):
+
+    # Just enough of a PreparedRequest for WSGIAdapter to build an environ from.
+
+    def __init__(self, method, url, headers, body):
+        self.method = method
+        self.url = url
+        self.headers = CaseInsensitiveDict(headers)
+        self.body = body
+
+
+def _serialise_request(request):
+    body = request.body
+    if body is not None and not isinstance(body, bytes):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif hasattr(body, 'read'):
+            body = body.read()
+        else:
+            body = b''.join(c.encode('utf-8') if isinstance(c, str) else c for c in body)
+        headers = [(k, v) for (k, v) in request.headers.items()
+                   if k.lower() != 'transfer-encoding']
+        headers.append(('Content-Length', str(len(body))))
+    else:
+        headers = list(request.headers.items())
+    return (request.method, request.url, headers, body)
+
+
+def _serve(spec, extra_environ, conn):
+    # The main loop of a worker process.
+    #
+    # Each request is received as a tuple from _serialise_request, and the response is sent
+    # back as a (status, headerlist) tuple, followed by each non-empty chunk of the body as
+    # raw bytes, an empty chunk to mark the end, and then either None or the exception that
+    # interrupted the body.
+    adapter = WSGIAdapter(load_app(spec), extra_environ, raw=True)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        environ = adapter._make_environ(_WorkerRequest(*message))
+        try:
+            appresp = adapter._call_app(environ)
+        except Exception as e:  # pylint: disable=broad-except
+            conn.send(_picklable(e))
+            continue
+        conn.send((appresp.status, list(appresp.headerlist)))
+        error = None
+        try:
+            for chunk in appresp._app_iter:
+                if chunk:
+                    conn.send_bytes(chunk)
+        except Exception as e:  # pylint: disable=broad-except
+            error = _picklable(e)
+        finally:
+            iter_close(appresp._app_iter)
+        conn.send_bytes(b'')
+        conn.send(error)
+
+
+def _picklable(exc):
+    import pickle
+    try:
+        pickle.dumps(exc)
+    except Exception:  # pylint: disable=broad-except
+        exc = RuntimeError('%s: %s' % (type(exc).__name__, exc))
+    return exc
+
+
+class _Worker(object):
+
+    def __init__(self, context, spec, extra_environ):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(spec, extra_environ, child_conn),
+                                       name='pyriform-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):  # pragma: no cover
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class ProcessWSGIAdapter(BaseAdapter):
+
+    '''A Requests adapter which sends requests to a WSGI app running in a pool of processes.
+
+    The app is called in the same way as :py:class:`~pyriform.WSGIAdapter` does in raw mode;
+    response bodies are streamed back from the worker process a chunk at a time.
+
+    Each worker handles one request at a time. If a response isn't read to the end before
+    being closed (or a request times out), the worker handling it is replaced.
+
+    Args:
+        app (string): The app to send requests to, given as ``module:callable`` - each
+            worker process imports the app itself.
+        processes (int): The maximum number of worker processes to run; defaults to the
+            number of CPUs. Workers are started as they are needed.
+        extra_environ (dict of string -> string): Extra environment values that
+            the WSGI app will inherit for every request that it handles.
+        mp_context (string): The :py:mod:`multiprocessing` start method to use for the
+            workers (e.g. ``spawn`` or ``fork``).
+    '''
+    def __init__(self, app, processes=None, extra_environ=None, mp_context=None):
+        super(ProcessWSGIAdapter, self).__init__()
+        if ':' not in app:
+            raise ValueError('app specification must be in the form module:callable')
+        self.app = app
+        self.processes = processes or os.cpu_count() or 1
+        self.extra_environ = extra_environ
+        self._context = multiprocessing.get_context(mp_context)
+        self._idle = queue.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            start_new = self._started < self.processes
+            if start_new:
+                self._started += 1
+        if not start_new:
+            return self._idle.get()
+        try:
+            return _Worker(self._context, self.app, self.extra_environ)
+        except Exception:
+            self._discard(None)
+            raise
+
+    def _release(self, worker):
+        self._idle.put(worker)
+
+    def _discard(self, worker):
+        if worker is not None:
+            worker.kill()
+        with self._lock:
+            self._started -= 1
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+
+        # We only care about the read timeout.
+        if isinstance(timeout, tuple):
+            _, timeout = timeout
+
+        message = _serialise_request(request)
+        worker = self._acquire()
+        try:
+            worker.conn.send(message)
+            ready = not timeout or worker.conn.poll(timeout)
+            start = worker.conn.recv() if ready else None
+        except (EOFError, OSError) as e:
+            self._discard(worker)
+            raise ConnectionError('worker process for %s failed: %r' % (self.app, e),
+                                  request=request)
+        except BaseException:
+            self._discard(worker)
+            raise
+
+        if not ready:
+            self._discard(worker)
+            raise Timeout()
+
+        if isinstance(start, Exception):
+            self._release(worker)
+            raise start
+
+        status, headerlist = start
+        status_code, _, reason = status.partition(' ')
+        return _make_response(request, int(status_code), reason, headerlist,
+                              _WorkerBody(self, worker), stream)
+
+    def close(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+            with self._lock:
+                self._started -= 1
+
+
+class _WorkerBody(object):
+
+    # Reads the chunks of a response body from a worker, and hands the worker back to
+    # the adapter once it has finished with it.
+
+    def __init__(self, adapter, worker):
+        self.adapter = adapter
+        self.worker = worker
+
+    def __iter__(self):
+        conn = self.worker.conn
+        try:
+            while True:
+                chunk = conn.recv_bytes()
+                if not chunk:
+                    break
+                yield chunk
+            error = conn.recv()
+        except (EOFError, OSError) as e:
+            self.close()
+            raise ConnectionError('worker process for %s failed: %r' % (self.adapter.app, e))
+
+        # The body is complete, so the worker is free for another request.
+        worker, self.worker = self.worker, None
+        self.adapter._release(worker)
+        if error is not None:
+            raise error
+
+    def close(self):
+        if self.worker is not None:
+            worker, self.worker = self.worker, None
+            self.adapter._discard(worker)
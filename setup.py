@@ -43,7 +43,7 @@ params = dict(
     license='MIT',
     url=url,
     keywords=['requests', 'wsgi'],
-    py_modules=['pyriform'],
+    packages=['pyriform'],
     include_package_data=True,
     namespace_packages=name.split('.')[:-1],
     python_requires='>=2.7',
@@ -51,13 +51,19 @@ params = dict(
         'requests',
         'six',
         'webtest',
+        'backports.functools_lru_cache; python_version<"3"',
+        'futures; python_version<"3"',
     ],
     extras_require={
+        'asgi': [
+            'httpx',
+        ],
         'testing': [
             'pytest>=2.8',
             'pytest-sugar',
             'httpbin',
             'cherrypy',
+            'httpx',
         ],
         'docs': [
             'sphinx',
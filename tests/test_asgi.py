@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import pytest
+from requests import Session, Timeout
+
+from pyriform.asgi import ASGIAdapter, ASGITransport
+
+
+async def echo_app(scope, receive, send):
+    # Echoes the request back as JSON, or does something special based on the path.
+    assert scope['type'] == 'http'
+    body = b''
+    while True:
+        message = await receive()
+        body += message['body']
+        if not message['more_body']:
+            break
+
+    if scope['path'] == '/delay':
+        await asyncio.sleep(2)
+
+    if scope['path'] == '/stream':
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        for i in range(3):
+            await send({'type': 'http.response.body', 'body': b'%d' % i, 'more_body': True})
+            await asyncio.sleep(0.5)
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    info = {
+        'method': scope['method'],
+        'scheme': scope['scheme'],
+        'path': scope['path'],
+        'raw_path': scope['raw_path'].decode('latin-1'),
+        'query': scope['query_string'].decode('latin-1'),
+        'server': list(scope['server']),
+        'headers': dict((k.decode(), v.decode()) for (k, v) in scope['headers']),
+        'body': body.decode('latin-1'),
+    }
+    await send({
+        'type': 'http.response.start',
+        'status': 201,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'x-men', b'Xavier'), (b'x-men', b'Cyclops')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(info).encode('utf-8')})
+
+
+@pytest.fixture(scope='module')
+def session():
+    sess = Session()
+    sess.mount('http://', ASGIAdapter(echo_app))
+    sess.mount('https://', ASGIAdapter(echo_app))
+    return sess
+
+
+def test_request_mapping(session):
+    resp = session.post('https://app.local:8443/a%20b/c?d=e', data=b'hello',
+                        headers={'X-Thing': 'yes'})
+    assert resp.status_code == 201
+    assert resp.reason == 'Created'
+    assert resp.headers['X-Men'] == 'Xavier, Cyclops'
+    info = resp.json()
+    assert info['method'] == 'POST'
+    assert info['scheme'] == 'https'
+    assert info['path'] == '/a b/c'
+    assert info['raw_path'] == '/a%20b/c'
+    assert info['query'] == 'd=e'
+    assert info['server'] == ['app.local', 8443]
+    assert info['headers']['host'] == 'app.local:8443'
+    assert info['headers']['x-thing'] == 'yes'
+    assert info['body'] == 'hello'
+
+
+def test_streamed_request_body(session):
+    resp = session.put('http://app.local/', data=(b'abc' for _ in range(100)))
+    assert resp.json()['body'] == 'abc' * 100
+
+
+def test_streamed_response(session):
+    import time
+    then = time.time()
+    resp = session.get('http://app.local/stream', stream=True)
+    assert resp.raw.read(1) == b'0'
+    assert time.time() - then < 0.5
+    assert resp.raw.read() == b'12'
+
+
+def test_timeout(session):
+    assert session.get('http://app.local/delay', timeout=3).status_code == 201
+    with pytest.raises(Timeout):
+        session.get('http://app.local/delay', timeout=0.5)
+
+
+def test_async_transport():
+    import httpx
+
+    async def main():
+        async with httpx.AsyncClient(transport=ASGITransport(echo_app)) as client:
+            # Requests are multiplexed on the one event loop, so these should all
+            # complete in roughly the time it takes to do one.
+            delayed = [client.get('http://app.local/delay') for _ in range(10)]
+            resps = await asyncio.gather(*delayed)
+            assert [r.status_code for r in resps] == [201] * 10
+
+            resp = await client.post('http://app.local/x?y=z', content=b'hi')
+            assert resp.reason_phrase == 'Created'
+            assert resp.headers['x-men'] == 'Xavier, Cyclops'
+            assert resp.json()['body'] == 'hi'
+            assert resp.json()['query'] == 'y=z'
+
+            async with client.stream('GET', 'http://app.local/stream') as resp:
+                chunks = [chunk async for chunk in resp.aiter_bytes()]
+            assert b''.join(chunks) == b'012'
+
+    import time
+    then = time.time()
+    asyncio.run(main())
+    assert time.time() - then < 5
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from pyriform import WSGIAdapter, batch, make_session
+from pyriform.pool import AppPool
+from requests import Request, Timeout
+import pytest
+
+
+def make_app():
+    # An app which notices if it is ever used by two threads at once.
+    state = {'busy': False}
+
+    def app(environ, start_response):
+        assert not state['busy'], 'app instance used concurrently'
+        state['busy'] = True
+        try:
+            time.sleep(0.01)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+        finally:
+            state['busy'] = False
+        return [str(id(state)).encode('ascii')]
+    return app
+
+
+@pytest.mark.parametrize('raw', [False, True])
+def test_pool_concurrency(raw):
+    pool = AppPool(make_app, size=2)
+    adapter = WSGIAdapter(pool, raw=raw)
+    requests = [Request('GET', 'http://app.local/%d' % i) for i in range(20)]
+    responses = list(batch(adapter, requests, concurrency=4))
+
+    assert all(resp.status_code == 200 for resp in responses)
+    assert len(set(resp.text for resp in responses)) == 2
+    assert pool.created == 2
+    assert pool.checkouts == 20
+    assert pool.contended > 0
+    assert pool.wait_time > 0
+    assert pool.in_use == 0
+
+
+def test_pool_timeout():
+    pool = AppPool(make_app, size=1, timeout=0.05)
+    session = make_session(pool, raw=True)
+
+    # The instance stays checked out until the response is closed.
+    resp = session.get('http://app.local/', stream=True)
+    assert pool.in_use == 1
+    with pytest.raises(Timeout):
+        session.get('http://app.local/')
+    assert pool.timeouts == 1
+
+    # Another thread can take it over once it has been released.
+    results = []
+    thread = threading.Thread(target=lambda: results.append(session.get('http://app.local/')))
+    thread.start()
+    time.sleep(0.01)
+    resp.close()
+    thread.join()
+    assert results[0].status_code == 200
+    assert pool.created == 1
+    assert pool.in_use == 0
+
+
+def test_pool_factory_error():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('cannot create app')
+        return make_app()
+
+    pool = AppPool(factory, size=1)
+    session = make_session(pool, raw=True)
+    with pytest.raises(RuntimeError):
+        session.get('http://app.local/')
+    assert pool.created == 0
+    assert session.get('http://app.local/').status_code == 200
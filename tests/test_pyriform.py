@@ -1,7 +1,7 @@
 from httpbin import app as binapp
 from pyriform import make_session
 from pyriform import WSGIAdapter
-from requests import Session
+from requests import Request, Session
 import cherrypy
 import pytest
 
@@ -14,8 +14,13 @@ pyriform_only = pytest.mark.skipif(
 
 class TestPyriform(object):
 
+    # WebTest marks bodies without a content type as being form data, so the app doesn't
+    # see them as raw data.
+    echoes_raw_body = False
+    adapter_kwargs = {}
+
     def setup_class(cls):
-        adapter = WSGIAdapter(binapp)
+        adapter = WSGIAdapter(binapp, **cls.adapter_kwargs)
         sess = Session()
         sess.mount('http://', adapter)
         sess.mount('https://', adapter)
@@ -145,7 +150,27 @@ class TestPyriform(object):
         jresp = resp.json()
         assert jresp['method'] == method
         assert jresp['url'] == url
-        assert jresp['data'] == ''
+        if with_body and self.echoes_raw_body:
+            assert jresp['data'] == the_bytes.decode('ascii')
+        else:
+            assert jresp['data'] == ''
+
+    @pytest.mark.parametrize('body_type', ['file', 'generator'])
+    def test_post_streamed_body(self, body_type):
+        import io
+        if body_type == 'file':
+            body = io.BytesIO(b'abc' * 1000)
+        else:
+            body = (b'abc' for _ in range(1000))
+
+        # httpbin refuses chunked requests, so we'll use our own app.
+        def echo_app(environ, start_response):
+            start_response('200 OK', [])
+            return [environ['wsgi.input'].read()]
+
+        sess = make_session(echo_app, **self.adapter_kwargs)
+        resp = sess.post('http://myapp.local/anything', data=body)
+        assert resp.content == b'abc' * 1000
 
     @pytest.mark.parametrize('status,reason', [
         (200, 'OK'), (404, 'NOT FOUND'), (410, 'GONE'), (502, 'BAD GATEWAY'),
@@ -317,3 +342,513 @@ class TestPyriform(object):
             'Passing a TestApp instance to WSGIAdapter prevents '
             'streamed requests from streaming content in real time.'
         )
+
+
+
+class TestPyriformRaw(TestPyriform):
+
+    # Run all of the same tests again, but calling the WSGI app directly.
+    echoes_raw_body = True
+    adapter_kwargs = {'raw': True}
+
+    @pyriform_only
+    def test_environ_headers(self):
+        environ = {'HTTP_X_FORWARDED_FOR': '123.123.456.123'}
+        sess = make_session(binapp, extra_environ=environ, raw=True)
+        resp = sess.get('http://myapp.local/anything?high=low')
+        assert resp.json()['origin'] == '123.123.456.123'
+
+    @pyriform_only
+    def test_environ_headers_http_host(self):
+        environ = {'HTTP_HOST': 'yourapp.local'}
+        sess = make_session(binapp, extra_environ=environ, raw=True)
+        url = 'http://myapp.local/anything?back=front'
+        resp = sess.get(url)
+        assert resp.json()['url'] == url.replace('myapp', 'yourapp')
+
+    @pyriform_only
+    def test_cannot_mix_raw_and_testapp(self):
+        from webtest.app import TestApp
+
+        with pytest.raises(ValueError):
+            WSGIAdapter(TestApp(binapp), raw=True)
+
+        with pytest.raises(ValueError):
+            WSGIAdapter(binapp, lint=True, raw=True)
+
+    @pyriform_only
+    def test_environ_paths(self):
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return [repr((environ['SERVER_NAME'], environ['SERVER_PORT'],
+                          environ['PATH_INFO'], environ['QUERY_STRING'])).encode('ascii')]
+
+        sess = make_session(app, raw=True)
+        assert sess.get('http://app.local:81/a%20b/c?d=e#f').text == \
+            repr(('app.local', '81', '/a b/c', 'd=e'))
+        assert sess.get('http://app.local').text == repr(('app.local', '80', '/', ''))
+
+    @pyriform_only
+    def test_streamed_input(self):
+        import io
+        produced = []
+
+        def body():
+            for chunk in [b'one', b'two', b'three']:
+                produced.append(chunk)
+                yield chunk
+
+        def app(environ, start_response):
+            # We should get the data as it's being generated.
+            stream = environ['wsgi.input']
+            first = stream.read(3)
+            seen = len(produced)
+            rest = stream.read()
+            start_response('200 OK', [])
+            return [repr((first, seen, rest, 'CONTENT_LENGTH' in environ,
+                          environ.get('wsgi.input_terminated'))).encode('ascii')]
+
+        sess = make_session(app, raw=True)
+        assert sess.post('http://app.local/', data=body()).text == \
+            repr((b'one', 1, b'twothree', False, True))
+
+        # Files are handed to the app as they are.
+        fileobj = io.BytesIO(b'onetwothree')
+
+        def file_app(environ, start_response):
+            start_response('200 OK', [])
+            return [repr((environ['wsgi.input'] is fileobj,
+                          environ['CONTENT_LENGTH'])).encode('ascii')]
+
+        sess = make_session(file_app, raw=True)
+        assert sess.post('http://app.local/', data=fileobj).text == repr((True, '11'))
+
+    @pyriform_only
+    def test_deferred_start_response(self):
+        # Apps are allowed to call start_response when the first chunk of the body is produced.
+        def app(environ, start_response):
+            start_response('201 Made It', [('X-Lazy', 'yes')])
+            yield b'late'
+            yield b' start'
+
+        resp = make_session(app, raw=True).get('http://app.local/')
+        assert resp.status_code == 201
+        assert resp.reason == 'Made It'
+        assert resp.headers['X-Lazy'] == 'yes'
+        assert resp.content == b'late start'
+
+
+@pyriform_only
+def test_timeout_worker_pool():
+    import threading
+    from requests import Timeout
+
+    release = threading.Event()
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            return iter([b'done'])
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/block':
+            release.wait()
+        start_response('200 OK', [])
+        return Body()
+
+    adapter = WSGIAdapter(app, raw=True, max_workers=1)
+    sess = Session()
+    sess.mount('http://', adapter)
+
+    # Timed requests are handled by the pool.
+    assert sess.get('http://app.local/', timeout=5).content == b'done'
+    assert len(closed) == 1
+
+    # Tie up the only worker, and then queue up another request behind it.
+    with pytest.raises(Timeout):
+        sess.get('http://app.local/block', timeout=0.1)
+    assert adapter.active_workers == 1
+    with pytest.raises(Timeout):
+        sess.get('http://app.local/', timeout=0.1)
+    assert adapter.queue_depth == 0  # The queued request was cancelled.
+
+    # The abandoned request is still tidied up once it completes.
+    release.set()
+    adapter.executor.submit(lambda: None).result()
+    assert adapter.active_workers == 0
+    assert len(closed) == 2
+
+    sess.close()
+    with pytest.raises(RuntimeError):
+        adapter.executor.submit(lambda: None)
+
+    with pytest.raises(ValueError):
+        WSGIAdapter(app, max_workers=1, executor=adapter.executor)
+
+
+
+@pyriform_only
+@pytest.mark.parametrize('session', [True, False])
+def test_batch(session):
+    from pyriform import batch
+    from requests import Request
+
+    urls = ['http://app.local/anything/%d' % i for i in range(20)]
+    reqs = [Request('GET', url) for url in urls]
+    resps = list(batch(binapp, reqs, concurrency=3, session=session, raw=True))
+    assert [r.json()['url'] for r in resps] == urls
+
+    # Redirects are only followed when we're using a session.
+    reqs = [Request('GET', 'http://app.local/redirect/1').prepare()]
+    resp, = batch(binapp, reqs, session=session)
+    assert resp.status_code == (200 if session else 302)
+
+
+@pyriform_only
+def test_batch_unordered():
+    import time
+    from pyriform import batch
+    from requests import Request
+
+    # The slow request should come last, and they should run concurrently.
+    then = time.time()
+    reqs = [Request('GET', 'http://app.local/delay/%d' % d) for d in [2, 0, 0, 0]]
+    resps = batch(binapp, reqs, concurrency=4, ordered=False)
+    assert [r.url for r in resps][-1] == 'http://app.local/delay/2'
+    assert time.time() - then < 3
+
+
+
+@pyriform_only
+@pytest.mark.parametrize('raw', [False, True])
+def test_instrumentation(raw):
+    from pyriform.instrument import AdapterStats, Instrument
+
+    finished = []
+
+    class Recorder(Instrument):
+        def finished(self, timings):
+            finished.append(timings)
+
+    sess = make_session(binapp, raw=raw, instrument=Recorder())
+    resp = sess.get('http://app.local/bytes/5000?seed=1', stream=True)
+    assert not finished  # Not until the response has been closed.
+    assert len(resp.content) == 5000
+    resp.close()
+
+    timings, = finished
+    assert timings.status_code == 200
+    assert timings.body_bytes == 5000
+    phases = timings.phases()
+    assert set(phases) == {'prepare', 'handler', 'convert', 'first_byte', 'body', 'close'}
+    assert all(v >= 0 for v in phases.values())
+
+    # Now aggregate some stats, including a timed request.
+    stats = AdapterStats(profile=True)
+    sess = make_session(binapp, raw=raw, instrument=stats)
+    sess.get('http://app.local/get', timeout=5).close()
+    sess.get('http://app.local/status/404').close()
+    summary = stats.summary()
+    assert summary['requests'] == 2
+    assert summary['phases']['queue']['count'] == 1
+    assert summary['phases']['handler']['count'] == 2
+    assert stats.profiler.getstats()
+
+
+def test_iterstringio_chunks():
+    from pyriform import IterStringIO
+
+    chunks = [b'abc', b'', b'defgh', b'i']
+    stream = IterStringIO(iter(chunks))
+    assert stream.read(2) == b'ab'
+    assert stream.read(5) == b'cdefg'
+    assert stream.read1(10) == b'h'
+    assert stream.read() == b'i'
+    assert stream.read(3) == b''
+
+    # Whole chunks are handed back as they are, without being copied.
+    stream = IterStringIO(iter(chunks))
+    assert stream.read1() is chunks[0]
+    assert stream.read(5) is chunks[2]
+
+    buf = bytearray(7)
+    stream = IterStringIO(iter(chunks))
+    assert stream.readinto(buf) == 7
+    assert buf == b'abcdefg'
+    assert stream.readinto(buf) == 2
+    assert buf[:2] == b'hi'
+
+
+@pyriform_only
+@pytest.mark.parametrize('raw', [False, True])
+def test_response_cache(raw):
+    from pyriform.cache import ResponseCache
+
+    calls = []
+
+    def app(environ, start_response):
+        calls.append(environ['PATH_INFO'])
+        lang = environ.get('HTTP_ACCEPT_LANGUAGE', 'en')
+        if environ['PATH_INFO'] == '/fresh':
+            start_response('200 OK', [('Cache-Control', 'max-age=60'),
+                                      ('Vary', 'Accept-Language')])
+            return [lang.encode('ascii'), b'-body']
+        if environ.get('HTTP_IF_NONE_MATCH') == '"v1"':
+            start_response('304 Not Modified', [('ETag', '"v1"'), ('X-Checked', 'yes')])
+            return []
+        start_response('200 OK', [('ETag', '"v1"'), ('Cache-Control', 'no-cache')])
+        return [b'validated']
+
+    cache = ResponseCache(maxsize=2)
+    sess = make_session(app, raw=raw, cache=cache)
+
+    # Fresh responses are served without calling the app, per value of the Vary headers.
+    assert sess.get('http://app.local/fresh').text == 'en-body'
+    assert sess.get('http://app.local/fresh').text == 'en-body'
+    assert sess.get('http://app.local/fresh', headers={'Accept-Language': 'fr'}).text == 'fr-body'
+    assert sess.get('http://app.local/fresh', headers={'Accept-Language': 'fr'}).text == 'fr-body'
+    assert calls == ['/fresh', '/fresh']
+    assert (cache.hits, cache.misses, len(cache)) == (2, 2, 2)
+
+    # Stale responses are revalidated with the app, and the stored body is reused.
+    assert sess.get('http://app.local/etag').text == 'validated'
+    assert cache.evictions == 1
+    resp = sess.get('http://app.local/etag')
+    assert resp.status_code == 200
+    assert resp.text == 'validated'
+    assert resp.headers['X-Checked'] == 'yes'
+    assert cache.revalidations == 1
+    assert calls[2:] == ['/etag', '/etag']
+
+    # Other methods, and requests which don't want a cached response, go to the app.
+    sess.post('http://app.local/fresh', data=b'x')
+    sess.get('http://app.local/fresh', headers={'Cache-Control': 'no-store'})
+    assert calls[4:] == ['/fresh', '/fresh']
+
+    # Bodies are only stored once they have been read in full.
+    cache.clear()
+    sess.get('http://app.local/fresh', stream=True).close()
+    assert len(cache) == 0
+
+
+def test_response_cache_ttl():
+    from pyriform.cache import ResponseCache
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Cache-Control', 'max-age=60')])
+        return [b'x']
+
+    cache = ResponseCache(ttl=0)
+    sess = make_session(app, cache=cache)
+    sess.get('http://app.local/')
+    sess.get('http://app.local/')
+    assert (cache.hits, cache.misses, cache.evictions) == (0, 2, 1)
+
+
+def test_header_conversion():
+    from pyriform import _headers_to_environ, _merge_headers
+    from requests.structures import CaseInsensitiveDict
+
+    environ = {}
+    _headers_to_environ(CaseInsensitiveDict([
+        ('Content-Type', 'text/plain'), ('content-length', '4'), ('X-Custom-Header', 'a'),
+    ]), environ)
+    assert environ == {'CONTENT_TYPE': 'text/plain', 'CONTENT_LENGTH': '4',
+                       'HTTP_X_CUSTOM_HEADER': 'a'}
+
+    headers = CaseInsensitiveDict()
+    _merge_headers(headers, [('X-Men', 'Xavier'), ('Content-Type', 'text/plain'),
+                             ('x-men', 'Cyclops'), ('X-MEN', 'Storm')])
+    assert headers['x-men'] == 'Xavier, Cyclops, Storm'
+    assert list(headers) == ['X-Men', 'Content-Type']
+
+
+@pyriform_only
+@pytest.mark.parametrize('raw', [False, True])
+def test_unstreamed_content(raw):
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            return iter([b'Hello', b'', b'World'])
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return Body()
+
+    adapter = WSGIAdapter(app, raw=raw)
+    request = Request('GET', 'http://app.local/').prepare()
+
+    # The body is read and the app closed before the adapter returns.
+    resp = adapter.send(request)
+    assert closed == [True]
+    assert resp._content == b'HelloWorld'
+    assert resp.raw.read() == b''
+
+    resp = adapter.send(request, stream=True)
+    assert len(closed) == 1
+    assert resp.content == b'HelloWorld'
+    assert len(closed) == 2
+
+
+@pyriform_only
+@pytest.mark.parametrize('raw', [False, True])
+def test_spooled_response(raw):
+    from pyriform import MappedReader
+
+    sess = make_session(binapp, raw=raw, spool_threshold=1000)
+
+    # Small bodies stay in memory.
+    resp = sess.get('http://app.local/bytes/500?seed=1', stream=True)
+    assert not isinstance(resp.raw, MappedReader)
+    assert len(resp.content) == 500
+
+    # Large ones are written to a file, which can be read and seeked in.
+    expected = sess.get('http://app.local/bytes/5000?seed=1').content
+    resp = sess.get('http://app.local/bytes/5000?seed=1', stream=True)
+    reader = resp.raw
+    assert isinstance(reader, MappedReader)
+    assert reader.read(10) == expected[:10]
+    buf = bytearray(100)
+    assert reader.readinto(buf) == 100
+    assert buf == expected[10:110]
+    reader.seek(-5, 2)
+    assert reader.read() == expected[-5:]
+    reader.seek(0)
+    assert reader.read() == expected
+
+    resp.close()
+    assert reader.closed
+    assert reader.file.closed
+
+
+@pyriform_only
+@pytest.mark.parametrize('raw', [False, True])
+def test_file_wrapper(raw, tmp_path):
+    import io
+    from pyriform import FileReader
+
+    path = tmp_path / 'fixture.bin'
+    path.write_bytes(b'header:' + bytes(bytearray(range(256))) * 100)
+    opened = []
+
+    def app(environ, start_response):
+        f = open(str(path), 'rb')
+        opened.append(f)
+        f.read(7)  # Skip past the header.
+        start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+        return environ['wsgi.file_wrapper'](f)
+
+    expected = bytes(bytearray(range(256))) * 100
+    sess = make_session(app, raw=raw)
+    assert sess.get('http://app.local/').content == expected
+    assert opened[-1].closed
+
+    resp = sess.get('http://app.local/', stream=True)
+    assert isinstance(resp.raw, FileReader)
+    assert resp.raw.read(3) == expected[:3]
+    buf = bytearray(300)
+    assert resp.raw.readinto(buf) == 300
+    assert buf == expected[3:303]
+    resp.raw.seek(-10, 2)
+    assert resp.raw.read(100) == expected[-10:]
+    resp.raw.seek(0)
+    assert resp.content == expected
+    resp.close()
+    resp.raw.close()
+    assert opened[-1].closed
+
+    # Other file-like objects are iterated over as usual.
+    def bytesio_app(environ, start_response):
+        start_response('200 OK', [])
+        return environ['wsgi.file_wrapper'](io.BytesIO(expected), 1000)
+
+    resp = make_session(bytesio_app, raw=raw).get('http://app.local/', stream=True)
+    assert not isinstance(resp.raw, FileReader)
+    assert resp.content == expected
+
+
+@pyriform_only
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_timeout_cancellation(max_workers):
+    import threading
+    import time
+    from requests import ConnectionError, ReadTimeout, Timeout
+
+    release = threading.Event()
+    seen = []
+    closed = []
+
+    class Body(object):
+        def __init__(self, chunks):
+            self.chunks = chunks
+
+        def __iter__(self):
+            for chunk in self.chunks:
+                if chunk is None:
+                    release.wait()
+                else:
+                    yield chunk
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        seen.append(environ)
+        if environ['PATH_INFO'] == '/slow-start':
+            release.wait()
+        start_response('200 OK', [])
+        if environ['PATH_INFO'] == '/slow-body':
+            return Body([b'first', None, b'last'])
+        return Body([b'done'])
+
+    adapter = WSGIAdapter(app, raw=True, max_workers=max_workers, max_abandoned=1)
+    sess = Session()
+    sess.mount('http://', adapter)
+
+    # The app is told about the deadline, and isn't cancelled if it finishes in time.
+    before = time.time()
+    assert sess.get('http://app.local/', timeout=5).content == b'done'
+    assert before + 5 <= seen[-1]['pyriform.deadline'] <= time.time() + 5
+    assert not seen[-1]['pyriform.cancel'].is_set()
+    sess.get('http://app.local/')
+    assert 'pyriform.cancel' not in seen[-1]
+
+    # Apps which time out are told that they have been cancelled.
+    with pytest.raises(Timeout):
+        sess.get('http://app.local/slow-start', timeout=0.05)
+    assert seen[-1]['pyriform.cancel'].is_set()
+    assert adapter.abandoned_requests == 1
+
+    # We won't leave any more requests running in the background.
+    with pytest.raises(ConnectionError):
+        sess.get('http://app.local/', timeout=1)
+    assert sess.get('http://app.local/').content == b'done'  # Untimed requests are fine.
+
+    release.set()
+    while adapter.abandoned_requests:
+        time.sleep(0.01)
+    assert len(closed) == 4
+
+    # The timeout applies to each chunk of the body too.
+    release.clear()
+    resp = sess.get('http://app.local/slow-body', timeout=0.05, stream=True)
+    chunks = resp.iter_content(None)
+    assert next(chunks) == b'first'
+    with pytest.raises(ReadTimeout):
+        next(chunks)
+    assert seen[-1]['pyriform.cancel'].is_set()
+    assert adapter.abandoned_requests == 1
+    assert len(closed) == 4
+
+    release.set()
+    while adapter.abandoned_requests:
+        time.sleep(0.01)
+    assert len(closed) == 5
+    sess.close()
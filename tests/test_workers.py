@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from requests import ConnectionError, Session, Timeout  # pylint: disable=redefined-builtin
+
+from pyriform.workers import ProcessWSGIAdapter, load_app
+
+
+@pytest.fixture(scope='module')
+def adapter():
+    adapter = ProcessWSGIAdapter('httpbin:app', processes=2)
+    yield adapter
+    adapter.close()
+
+
+@pytest.fixture
+def session(adapter):
+    sess = Session()
+    sess.mount('http://', adapter)
+    return sess
+
+
+def test_load_app():
+    from httpbin import app
+    assert load_app('httpbin:app') is app
+    assert load_app('httpbin:app.wsgi_app') == app.wsgi_app
+    with pytest.raises(ValueError):
+        load_app('httpbin')
+
+
+def test_get_and_post(session):
+    url = 'http://myapp.local:8080/anything/hello?how=are+you'
+    resp = session.get(url)
+    assert resp.json()['url'] == url
+
+    resp = session.post(url, json=[1, 3])
+    assert resp.json()['json'] == [1, 3]
+
+    resp = session.get('http://myapp.local/response-headers?X-Men=Xavier&X-Men=Cyclops')
+    assert resp.headers['X-Men'] == 'Xavier, Cyclops'
+
+    resp = session.get('http://myapp.local/status/410')
+    assert resp.status_code == 410
+
+
+def test_streamed_body(session):
+    then = time.time()
+    resp = session.get('http://server/drip?duration=2&numbytes=4', stream=True)
+    assert resp.raw.read(1) == b'*'
+    assert time.time() - then < 1.5
+    assert resp.raw.read() == b'***'
+
+
+def test_early_close_replaces_worker(adapter, session):
+    resp = session.get('http://server/drip?duration=2&numbytes=4', stream=True)
+    resp.raw.read(1)
+    resp.close()
+    assert session.get('http://myapp.local/get').status_code == 200
+
+
+def test_timeout(session):
+    with pytest.raises(Timeout):
+        session.get('http://myapp.local/delay/2', timeout=0.5)
+    assert session.get('http://myapp.local/delay/1', timeout=3).status_code == 200
+
+
+def test_bad_app():
+    sess = Session()
+    sess.mount('http://', ProcessWSGIAdapter('no_such_module_here:app', processes=1))
+    with pytest.raises(ConnectionError):
+        sess.get('http://myapp.local/get')